@@ -0,0 +1,105 @@
+"""Background removal stage: clean-background pre-check and model choice."""
+
+import asyncio
+import io
+import threading
+
+import httpx
+import numpy as np
+from PIL import Image
+from rembg import new_session, remove
+
+from backend import imaging, metrics, scheduler
+from backend.config import REMBG_CLEAN_BG_MAX_STD, REMBG_LIGHT_MODEL, REMBG_MODEL, REMBG_SERVICE_URL
+
+# Width in pixels of the frame sampled by the clean-background check
+BORDER_BAND = 8
+
+# Preload the primary model at import time (server startup) so the first
+# request doesn't pay the ~10s model download/load cost. The light model is
+# small and loaded on first use. API workers that delegate to a shared rembg
+# service (REMBG_SERVICE_URL) load no model at all.
+_models = {} if REMBG_SERVICE_URL else {REMBG_MODEL: new_session(REMBG_MODEL)}
+_models_lock = threading.Lock()
+
+
+def _session(model_name: str):
+    """Get (or lazily create) the rembg session for a model."""
+    with _models_lock:
+        if model_name not in _models:
+            _models[model_name] = new_session(model_name)
+        return _models[model_name]
+
+
+def border_std(img: Image.Image, band: int = BORDER_BAND) -> float:
+    """Largest per-channel standard deviation of the pixels along the image border."""
+    arr = np.asarray(img.convert("RGB"), dtype=np.float32)
+    band = max(1, min(band, arr.shape[0] // 2, arr.shape[1] // 2))
+    border = np.concatenate([
+        arr[:band].reshape(-1, 3),
+        arr[-band:].reshape(-1, 3),
+        arr[band:-band, :band].reshape(-1, 3),
+        arr[band:-band, -band:].reshape(-1, 3),
+    ])
+    return float(border.std(axis=0).max())
+
+
+def has_clean_background(img: Image.Image) -> bool:
+    """True if the border is a near-uniform colour (plain studio backdrop)."""
+    return border_std(img) <= REMBG_CLEAN_BG_MAX_STD
+
+
+def pick_model(img: Image.Image) -> str:
+    """Use the light model for plain backdrops, the full model otherwise."""
+    if REMBG_LIGHT_MODEL and has_clean_background(img):
+        return REMBG_LIGHT_MODEL
+    return REMBG_MODEL
+
+
+def cut_out(img: Image.Image) -> Image.Image:
+    """Cut the subject out of a decoded RGB image. Blocking; returns a new RGBA image."""
+    mask = remove(img, session=_session(pick_model(img)), only_mask=True)
+    out = img.convert("RGBA")
+    out.putalpha(mask)
+    return out
+
+
+def remove_background(data: bytes) -> bytes:
+    """Cut the subject out of an encoded image. Blocking; returns PNG bytes."""
+    with Image.open(io.BytesIO(data)) as src:
+        img = src.convert("RGB")
+
+    with img, cut_out(img) as out:
+        return imaging.encode_png(out)
+
+
+async def remove_background_async(data: bytes) -> bytes:
+    """remove_background, run on the shared rembg service if configured, else off-loop here."""
+    if not REMBG_SERVICE_URL:
+        return await scheduler.run("rembg", "rembg", remove_background, data)
+
+    async with scheduler.slot("rembg"), metrics.timed("rembg"):
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            resp = await client.post(
+                f"{REMBG_SERVICE_URL}/remove",
+                content=data,
+                headers={"Content-Type": "application/octet-stream"},
+            )
+            resp.raise_for_status()
+    return resp.content
+
+
+def _open_cutout(png: bytes) -> Image.Image:
+    with Image.open(io.BytesIO(png)) as img:
+        return img.convert("RGBA")
+
+
+async def cut_out_async(img: Image.Image, data: bytes | None = None) -> Image.Image:
+    """
+    cut_out, off-loop. With a shared rembg service the encoded bytes (data)
+    are sent there instead and the returned PNG is decoded here.
+    """
+    if not REMBG_SERVICE_URL:
+        return await scheduler.run("rembg", "rembg", cut_out, img)
+    png = await remove_background_async(data)
+    return await asyncio.to_thread(_open_cutout, png)
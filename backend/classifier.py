@@ -1,79 +1,133 @@
 """Gemini Vision: describe outfits and update descriptions from chat."""
 
 import asyncio
-import json
+import io
+from collections import OrderedDict
 
 from google import genai
 from google.genai import types
 import httpx
+from PIL import Image
 
-from backend.config import GEMINI_API_KEY
+from backend import degraded, imaging, metrics, scheduler
+from backend.config import GEMINI_API_KEY, GEMINI_IMAGE_TOKEN_BUDGET, GEMINI_THINKING_BUDGET
 from backend.models import ClassificationResult
 
 _client = genai.Client(api_key=GEMINI_API_KEY)
 
-CLASSIFY_PROMPT = """Analyze this clothing image. Return a JSON object with:
-{
-    "description": "detailed description of the full outfit including all visible garments, colors, and materials",
-    "fit_notes": "fit and silhouette notes (e.g. oversized, slim, relaxed)",
-    "colors": ["color1", "color2"],
-    "style": "style category (e.g. streetwear, smart casual, formal)"
-}
-Only return valid JSON, no other text."""
+GEMINI_MODEL = "gemini-2.5-flash"
 
-UPDATE_PROMPT_TEMPLATE = """You are editing a clothing outfit description. Here is the CURRENT description (treat this as the source of truth):
+# Gemini bills an image as 258 tokens per 768x768 tile (one tile if both sides <= 384)
+TILE_SIZE = 768
+TOKENS_PER_TILE = 258
 
-{current_description}
+# Formats Gemini accepts as-is; anything else is re-encoded as JPEG
+GEMINI_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+# The response schema enforces the JSON shape, so prompts only carry the task
+_GENERATE_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=ClassificationResult,
+    thinking_config=types.ThinkingConfig(thinking_budget=GEMINI_THINKING_BUDGET),
+)
+
+CLASSIFY_PROMPT = (
+    "Describe the outfit in this clothing image. description: the full outfit with all "
+    "visible garments, colors and materials. fit_notes: fit and silhouette (e.g. oversized, "
+    "slim, relaxed). colors: main colors. style: style category (e.g. streetwear, smart casual)."
+)
 
-The user wants ONE specific change: "{user_message}"
+UPDATE_PROMPT_TEMPLATE = """Edit this outfit description (source of truth):
+{current_description}
 
+Apply ONLY this change: "{user_message}"
 {new_image_context}
+Keep every other detail word-for-word. Do not add or re-interpret details. Update fit_notes, colors and style only if the change affects them."""
+
+
+# Recent classifications by image URL, served instead of calling Gemini in degraded mode
+CLASSIFICATION_CACHE_SIZE = 256
+_classifications: OrderedDict[str, ClassificationResult] = OrderedDict()
+
+# Degraded-mode stand-in for an image never classified; FLUX still sees the image itself
+FALLBACK_CLASSIFICATION = ClassificationResult(
+    description="the outfit shown in the reference image",
+    fit_notes="",
+    colors=[],
+    style="",
+)
+
+
+def _fit_token_budget(width: int, height: int, budget: int = GEMINI_IMAGE_TOKEN_BUDGET) -> int:
+    """Largest longest-side that keeps an image within the token budget (at least one tile)."""
+    max_tiles = max(1, budget // TOKENS_PER_TILE)
+    scale = 0.0
+    for cols in range(1, max_tiles + 1):
+        rows = max_tiles // cols
+        scale = max(scale, min(cols * TILE_SIZE / width, rows * TILE_SIZE / height))
+    longest = max(width, height)
+    return min(longest, int(longest * scale))
+
+
+def _image_part(image_bytes: bytes) -> types.Part:
+    """Downscale to the token budget if needed and label with the real MIME type. Blocking."""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        fmt, (width, height) = img.format, img.size
 
-IMPORTANT RULES:
-- ONLY change what the user explicitly asked to change
-- Keep ALL other details EXACTLY as they are in the current description
-- Do NOT add new details, embellishments, seams, stitching, or features that aren't in the current description
-- Do NOT re-interpret or re-analyze the outfit — just apply the requested change
-- If the user says "make the pants black", change ONLY the pants color to black. Everything else stays identical.
+    max_dimension = _fit_token_budget(width, height)
+    if max_dimension >= max(width, height) and fmt in GEMINI_MIME_TYPES:
+        return types.Part.from_bytes(data=image_bytes, mime_type=GEMINI_MIME_TYPES[fmt])
 
-Return the updated JSON:
-{{
-    "description": "the current description with ONLY the requested change applied",
-    "fit_notes": "keep existing fit notes, only update if the user's change affects fit",
-    "colors": ["updated", "color", "list"],
-    "style": "style category"
-}}
-Only return valid JSON, no other text."""
+    prepared = imaging.prepare(image_bytes, max_dimension)
+    return types.Part.from_bytes(data=prepared.buf.getvalue(), mime_type="image/jpeg")
 
 
-def _extract_json(text: str) -> dict:
-    """Strip markdown code fences if present, then parse JSON."""
-    text = text.strip()
-    if text.startswith("```"):
-        text = text.split("\n", 1)[1].rsplit("```", 1)[0]
-    return json.loads(text)
+async def _download_part(image_url: str) -> types.Part:
+    async with httpx.AsyncClient() as client:
+        resp = await client.get(image_url)
+        resp.raise_for_status()
+    return await asyncio.to_thread(_image_part, resp.content)
+
+
+async def _generate(call: str, contents: list) -> ClassificationResult:
+    """Run a schema-constrained Gemini call and record its latency and token usage."""
+    response = await scheduler.run(
+        "gemini",
+        f"gemini.{call}",
+        _client.models.generate_content,
+        model=GEMINI_MODEL,
+        contents=contents,
+        config=_GENERATE_CONFIG,
+    )
+
+    usage = response.usage_metadata
+    if usage is not None:
+        metrics.count(f"gemini.{call}.input_tokens", usage.prompt_token_count or 0)
+        metrics.count(f"gemini.{call}.output_tokens", usage.candidates_token_count or 0)
+        metrics.count(f"gemini.{call}.thinking_tokens", usage.thoughts_token_count or 0)
+
+    if isinstance(response.parsed, ClassificationResult):
+        return response.parsed
+    return ClassificationResult.model_validate_json(response.text)
 
 
 async def classify_image(image_url: str) -> ClassificationResult:
     """Classify a Pinterest image and extract outfit description."""
-    try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(image_url)
-            resp.raise_for_status()
-            image_bytes = resp.content
+    if degraded.use("cached_classifications"):
+        return _classifications.get(image_url, FALLBACK_CLASSIFICATION)
 
-        image_part = types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg")
-
-        response = await asyncio.to_thread(
-            _client.models.generate_content,
-            model="gemini-2.5-flash",
-            contents=[CLASSIFY_PROMPT, image_part],
-        )
-        parsed = _extract_json(response.text)
-        return ClassificationResult(**parsed)
+    try:
+        image_part = await _download_part(image_url)
+        result = await _generate("classify", [CLASSIFY_PROMPT, image_part])
     except Exception as e:
         raise RuntimeError(f"Classification failed: {e}") from e
 
+    _classifications[image_url] = result
+    _classifications.move_to_end(image_url)
+    while len(_classifications) > CLASSIFICATION_CACHE_SIZE:
+        _classifications.popitem(last=False)
+    return result
+
 
 async def update_description(
     current_description: str,
@@ -86,15 +140,8 @@ async def update_description(
         parts: list = []
 
         if new_image_url:
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(new_image_url)
-                resp.raise_for_status()
-                image_bytes = resp.content
-            new_image_context = (
-                "The user also provided a new garment image (attached). "
-                "Incorporate this item into the outfit description."
-            )
-            parts.append(types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg"))
+            parts.append(await _download_part(new_image_url))
+            new_image_context = "Add the garment in the attached image to the outfit.\n"
 
         prompt = UPDATE_PROMPT_TEMPLATE.format(
             current_description=current_description,
@@ -103,12 +150,6 @@ async def update_description(
         )
         parts.insert(0, prompt)
 
-        response = await asyncio.to_thread(
-            _client.models.generate_content,
-            model="gemini-2.5-flash",
-            contents=parts,
-        )
-        parsed = _extract_json(response.text)
-        return ClassificationResult(**parsed)
+        return await _generate("update", parts)
     except Exception as e:
         raise RuntimeError(f"Description update failed: {e}") from e
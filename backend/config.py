@@ -7,8 +7,133 @@ REPLICATE_API_TOKEN: str = os.getenv("REPLICATE_API_TOKEN", "")
 GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
 BASE_URL: str = os.getenv("BASE_URL", "http://localhost:8000")
 
-PHOTOS_DIR: str = "photos"
+# Point these at a shared directory when running several workers (see backend/serve.py)
+PHOTOS_DIR: str = os.getenv("PHOTOS_DIR", "photos")
+RESULTS_DIR: str = os.getenv("RESULTS_DIR", "results")
 VALID_PHOTO_TYPES: list[str] = ["face", "upper_body", "full_body"]
+# Photo types that can be the reference photo for a generation
+GENERATION_PHOTO_TYPES: list[str] = ["upper_body", "full_body"]
 
 MAX_DIMENSION: int = 1024
+# Resampling backend for input images: "auto", "pillow" or "opencv"
+RESIZE_BACKEND: str = os.getenv("RESIZE_BACKEND", "auto")
 SESSION_TTL_SECONDS: int = 3600
+# "memory" (single process) or "sqlite" (shared by all workers at SESSION_DB_PATH)
+SESSION_STORE: str = os.getenv("SESSION_STORE", "memory")
+SESSION_DB_PATH: str = os.getenv("SESSION_DB_PATH", "sessions.db")
+
+# Background removal: full model, light model for plain backdrops ("" disables)
+REMBG_MODEL: str = os.getenv("REMBG_MODEL", "u2net")
+REMBG_LIGHT_MODEL: str = os.getenv("REMBG_LIGHT_MODEL", "u2netp")
+# Max per-channel std-dev of border pixels for a backdrop to count as "clean"
+REMBG_CLEAN_BG_MAX_STD: float = float(os.getenv("REMBG_CLEAN_BG_MAX_STD", "12"))
+# If set, background removal is sent to this shared rembg service
+# (backend/rembg_service.py) instead of loading a model in every API worker
+REMBG_SERVICE_URL: str = os.getenv("REMBG_SERVICE_URL", "")
+
+# Result delivery: encoder quality for negotiated WebP/AVIF variants
+RESULT_WEBP_QUALITY: int = int(os.getenv("RESULT_WEBP_QUALITY", "85"))
+RESULT_AVIF_QUALITY: int = int(os.getenv("RESULT_AVIF_QUALITY", "60"))
+
+# Generation providers in preference order ("flux", "idm-vton"), and the
+# per-request budgets the router uses to pick between them
+GENERATION_PROVIDERS: list[str] = os.getenv("GENERATION_PROVIDERS", "flux,idm-vton").split(",")
+GENERATION_LATENCY_BUDGET_S: float = float(os.getenv("GENERATION_LATENCY_BUDGET_S", "30"))
+GENERATION_COST_BUDGET_USD: float = float(os.getenv("GENERATION_COST_BUDGET_USD", "0.10"))
+# IDM-VTON garment category: "upper_body", "lower_body" or "dresses"
+IDMVTON_CATEGORY: str = os.getenv("IDMVTON_CATEGORY", "upper_body")
+
+# Gemini: image token budget per call (258 tokens = one 768x768 tile) and
+# thinking budget for gemini-2.5-flash (0 disables thinking)
+GEMINI_IMAGE_TOKEN_BUDGET: int = int(os.getenv("GEMINI_IMAGE_TOKEN_BUDGET", "258"))
+GEMINI_THINKING_BUDGET: int = int(os.getenv("GEMINI_THINKING_BUDGET", "0"))
+
+# Memory: new generations wait at admission while the image buffers held by
+# in-flight requests exceed this many bytes (0 disables the budget)
+MEMORY_BUDGET_BYTES: int = int(os.getenv("MEMORY_BUDGET_BYTES", str(512 * 1024 * 1024)))
+
+
+
+def _parse_variants(name: str, default: str) -> list[tuple[str, int | None]]:
+    """Parse "format" / "format@max_size" items from the environment; empty items are skipped."""
+    variants: list[tuple[str, int | None]] = []
+    for spec in os.getenv(name, default).split(","):
+        if not spec.strip():
+            continue
+        result_format, _, size = spec.strip().partition("@")
+        try:
+            if result_format not in ("png", "webp", "avif"):
+                raise ValueError
+            max_size = int(size) if size else None
+            if max_size is not None and max_size <= 0:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"{name}: expected png, webp or avif with an optional @max_size, got {spec!r}") from None
+        variants.append((result_format, max_size))
+    return variants
+
+
+# Result variants encoded straight from the decoded cutout while the PNG is
+# written, as "format" or "format@max_size" (e.g. "webp,webp@256"), so the
+# first /try-on or /chat delivery doesn't re-decode the stored PNG
+RESULT_PRECOMPUTE: list[tuple[str, int | None]] = _parse_variants("RESULT_PRECOMPUTE", "webp")
+
+# Upload the user's resized reference photo to Replicate's file API once at
+# /upload-photo, so generations pass a file URL instead of re-sending the bytes
+REPLICATE_UPLOAD_USER_PHOTOS: bool = os.getenv("REPLICATE_UPLOAD_USER_PHOTOS", "false").lower() in ("1", "true", "yes")
+
+# Degraded mode: "auto" sheds work when a stage's recent p95 latency or error
+# rate crosses its threshold, "on" always applies DEGRADED_ACTIONS, "off" never
+DEGRADED_MODE: str = os.getenv("DEGRADED_MODE", "auto")
+# Which shortcuts may be taken: skip_rembg, cached_classifications, lower_quality, cheap_provider
+DEGRADED_ACTIONS: list[str] = os.getenv(
+    "DEGRADED_ACTIONS", "skip_rembg,cached_classifications,lower_quality,cheap_provider"
+).split(",")
+
+
+def _parse_stage_thresholds(name: str, default: str) -> dict[str, float]:
+    """Parse "stage=seconds,..." from the environment; empty items are skipped."""
+    thresholds: dict[str, float] = {}
+    for pair in os.getenv(name, default).split(","):
+        if not pair.strip():
+            continue
+        stage, _, seconds = pair.partition("=")
+        try:
+            if not stage.strip():
+                raise ValueError
+            thresholds[stage.strip()] = float(seconds)
+        except ValueError:
+            raise ValueError(f"{name}: expected stage=seconds pairs, got {pair!r}") from None
+    return thresholds
+
+
+# Per-stage p95 latency thresholds as "stage=seconds" pairs
+DEGRADED_STAGE_P95_S: dict[str, float] = _parse_stage_thresholds(
+    "DEGRADED_STAGE_P95_S", "provider.flux=45,provider.idm-vton=45,gemini.classify=8,rembg=10"
+)
+DEGRADED_ERROR_RATE: float = float(os.getenv("DEGRADED_ERROR_RATE", "0.5"))
+# Only calls from the last DEGRADED_WINDOW_S seconds count, so a stage that is
+# being skipped recovers once its slow samples age out
+DEGRADED_WINDOW_S: float = float(os.getenv("DEGRADED_WINDOW_S", "120"))
+DEGRADED_MIN_SAMPLES: int = int(os.getenv("DEGRADED_MIN_SAMPLES", "3"))
+# Settings used by lower_quality: max side of the generation inputs and FLUX output quality
+DEGRADED_INPUT_MAX_DIMENSION: int = int(os.getenv("DEGRADED_INPUT_MAX_DIMENSION", "768"))
+DEGRADED_OUTPUT_QUALITY: int = int(os.getenv("DEGRADED_OUTPUT_QUALITY", "75"))
+
+# Append a sanitized trace of every try-on/chat request to this JSONL file
+# (see backend/traces.py and tests/replay.py); empty disables tracing
+TRACE_PATH: str = os.getenv("TRACE_PATH", "")
+# Secret key for the HMAC that replaces strings in traces. Set the same key on
+# every worker so their traces match up (backend/serve.py generates a shared
+# one); unset, each process picks a random one and logs a warning.
+TRACE_HASH_KEY: str = os.getenv("TRACE_HASH_KEY", "")
+
+# Scheduler: concurrent calls allowed per stage (see backend/scheduler.py).
+# Gemini and local rembg also get a thread pool of this size. One slot per
+# stage is kept for chat turns, so these should cover peak try-on traffic
+# plus headroom; Replicate predictions are mostly remote waiting.
+SCHEDULER_GEMINI_CONCURRENCY: int = int(os.getenv("SCHEDULER_GEMINI_CONCURRENCY", "8"))
+SCHEDULER_REPLICATE_CONCURRENCY: int = int(os.getenv("SCHEDULER_REPLICATE_CONCURRENCY", "16"))
+SCHEDULER_REMBG_CONCURRENCY: int = int(os.getenv("SCHEDULER_REMBG_CONCURRENCY", "4"))
+# Slots of one stage a single client may hold for try-ons at once
+SCHEDULER_TRYON_PER_USER: int = int(os.getenv("SCHEDULER_TRYON_PER_USER", "1"))
@@ -0,0 +1,103 @@
+"""Degraded mode: shed optional work while a pipeline stage is saturated.
+
+Each shortcut relieves one stage and is only taken while that stage's recent
+p95 latency or error rate (see metrics.StageStats.recent) is over its
+DEGRADED_* threshold:
+
+    rembg            -> skip_rembg: store the generated image without cutting it out
+    gemini.classify  -> cached_classifications: reuse past classifications, never call Gemini
+    provider.flux    -> cheap_provider: try the cheaper provider first
+                        lower_quality: smaller FLUX inputs, lower output quality
+    provider.idm-vton -> lower_quality: smaller IDM-VTON inputs
+
+Shortcuts taken for a request are collected with track()/use() and returned
+to the client; /metrics shows the current mode.
+"""
+
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from backend import metrics
+from backend.config import (
+    DEGRADED_ACTIONS, DEGRADED_ERROR_RATE, DEGRADED_MIN_SAMPLES, DEGRADED_MODE,
+    DEGRADED_STAGE_P95_S, DEGRADED_WINDOW_S,
+)
+
+STAGE_ACTIONS: dict[str, tuple[str, ...]] = {
+    "rembg": ("skip_rembg",),
+    "gemini.classify": ("cached_classifications",),
+    "provider.flux": ("cheap_provider", "lower_quality"),
+    "provider.idm-vton": ("lower_quality",),
+}
+
+
+@dataclass(frozen=True)
+class Mode:
+    actions: frozenset[str] = frozenset()
+    # Saturated stage -> why (e.g. "p95 52.1s > 45s")
+    reasons: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def name(self) -> str:
+        return "degraded" if self.actions else "normal"
+
+
+# Shortcuts taken by the current request (shared with the tasks it spawns)
+_applied: ContextVar[set[str] | None] = ContextVar("degraded_applied", default=None)
+
+
+def _saturation(stage: str) -> str | None:
+    """Why a stage counts as saturated right now, or None if it doesn't."""
+    stats = metrics.stage(stage).recent(DEGRADED_WINDOW_S)
+    if len(stats.samples) < DEGRADED_MIN_SAMPLES:
+        return None
+    p95, limit = stats.percentile(95), DEGRADED_STAGE_P95_S.get(stage)
+    if limit is not None and p95 > limit:
+        return f"p95 {p95:.1f}s > {limit:g}s"
+    if stats.error_rate >= DEGRADED_ERROR_RATE:
+        return f"error rate {stats.error_rate:.0%}"
+    return None
+
+
+def current() -> Mode:
+    """The shortcuts allowed right now, per DEGRADED_MODE and live stage stats."""
+    enabled = set(DEGRADED_ACTIONS)
+    if DEGRADED_MODE == "off":
+        return Mode()
+    if DEGRADED_MODE == "on":
+        return Mode(frozenset(enabled), {"*": "DEGRADED_MODE=on"})
+
+    actions: set[str] = set()
+    reasons: dict[str, str] = {}
+    for stage, stage_actions in STAGE_ACTIONS.items():
+        relieving = enabled.intersection(stage_actions)
+        if not relieving:
+            continue
+        reason = _saturation(stage)
+        if reason is not None:
+            actions |= relieving
+            reasons[stage] = reason
+    return Mode(frozenset(actions), reasons)
+
+
+def track() -> set[str]:
+    """Start collecting the shortcuts taken for the current request. Returns the live set."""
+    applied: set[str] = set()
+    _applied.set(applied)
+    return applied
+
+
+def use(action: str) -> bool:
+    """Whether to take a shortcut now; if so it is recorded for the request and in metrics."""
+    if action not in current().actions:
+        return False
+    applied = _applied.get()
+    if applied is not None:
+        applied.add(action)
+    metrics.count(f"degraded.{action}")
+    return True
+
+
+def snapshot() -> dict:
+    mode = current()
+    return {"mode": mode.name, "actions": sorted(mode.actions), "reasons": mode.reasons}
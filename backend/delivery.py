@@ -0,0 +1,76 @@
+"""Result delivery: re-encode try-on results in the format and size the client negotiated."""
+
+import asyncio
+import base64
+from dataclasses import dataclass
+from pathlib import Path
+
+from PIL import Image
+
+from backend import imaging
+from backend.config import BASE_URL, RESULT_PRECOMPUTE, RESULTS_DIR
+from backend.storage import atomic_write, atomic_write_async
+
+
+@dataclass
+class DeliveredResult:
+    url: str
+    data_url: str | None = None
+
+
+def _variant_name(stem: str, result_format: str, max_size: int | None) -> str:
+    return f"{stem}_{max_size or 'full'}.{imaging.RESULT_FORMATS[result_format][2]}"
+
+
+# (result format, max size) pairs, with AVIF resolved to WebP if it isn't built in
+PRECOMPUTE_VARIANTS = list(dict.fromkeys((imaging.result_format(f), size) for f, size in RESULT_PRECOMPUTE))
+
+
+async def precompute_variants(
+    img: Image.Image, stem: str, variants: list[tuple[str, int | None]] = PRECOMPUTE_VARIANTS,
+) -> None:
+    """Encode result variants from an already decoded cutout, in parallel, off-loop."""
+
+    async def encode(result_format: str, max_size: int | None) -> None:
+        data, _ = await asyncio.to_thread(imaging.encode_result, img, result_format, max_size)
+        await atomic_write_async(Path(RESULTS_DIR) / _variant_name(stem, result_format, max_size), data)
+
+    await asyncio.gather(*(encode(*variant) for variant in variants))
+
+
+def deliver_result(
+    result_url: str,
+    result_format: str = "png",
+    max_size: int | None = None,
+    inline: bool = False,
+) -> DeliveredResult:
+    """
+    Encode a stored PNG result as the requested variant. Blocking.
+
+    Variants are written next to the original (so repeated requests and
+    non-inline clients hit StaticFiles, and variants precomputed during
+    post-processing are reused); with inline=True the encoded bytes are also
+    returned as a data: URL so the client can skip the second fetch.
+    """
+    result_format = imaging.result_format(result_format)
+    source = Path(RESULTS_DIR) / result_url.rsplit("/", 1)[-1]
+
+    if result_format == "png" and not max_size:
+        if not inline:
+            return DeliveredResult(url=result_url)
+        data, mime = source.read_bytes(), "image/png"
+        target = source
+    else:
+        target = Path(RESULTS_DIR) / _variant_name(source.stem, result_format, max_size)
+        mime = imaging.RESULT_FORMATS[result_format][1]
+        if target.exists():
+            data = target.read_bytes()
+        else:
+            with Image.open(source) as img:
+                data, mime = imaging.encode_result(img, result_format, max_size)
+            atomic_write(target, data)
+
+    url = f"{BASE_URL}/results/{target.name}"
+    if not inline:
+        return DeliveredResult(url=url)
+    return DeliveredResult(url=url, data_url=f"data:{mime};base64,{base64.b64encode(data).decode()}")
@@ -2,6 +2,7 @@
 
 import asyncio
 import io
+from collections.abc import Awaitable, Callable
 from pathlib import Path
 
 import uuid
@@ -9,16 +10,16 @@ import uuid
 import httpx
 import replicate
 from PIL import Image
-from rembg import new_session, remove
 
-from backend.config import BASE_URL, MAX_DIMENSION, REPLICATE_API_TOKEN
-
-# Preload the background removal model at import time (server startup)
-# so the first request doesn't pay the ~10s model download/load cost
-_rembg_session = new_session("u2net")
+from backend import background, degraded, delivery, imaging, memory, scheduler
+from backend.config import (
+    BASE_URL, DEGRADED_INPUT_MAX_DIMENSION, DEGRADED_OUTPUT_QUALITY, MAX_DIMENSION,
+    PHOTOS_DIR, REMBG_SERVICE_URL, RESULTS_DIR,
+)
+from backend.photo_artifacts import PhotoArtifacts
+from backend.storage import atomic_write_async
 
-RESULTS_DIR = Path("results")
-RESULTS_DIR.mkdir(exist_ok=True)
+Path(RESULTS_DIR).mkdir(exist_ok=True)
 
 FLUX_MODEL = "black-forest-labs/flux-2-pro"
 
@@ -58,40 +59,8 @@ TEXT_MODIFY_PROMPT = (
 )
 
 
-ALLOWED_RATIOS = [
-    "1:1", "4:3", "3:4", "16:9", "9:16",
-    "3:2", "2:3", "4:5", "5:4", "21:9", "9:21",
-]
-
-
-def _pick_aspect_ratio(width: int, height: int) -> str:
-    """Pick the closest FLUX-supported aspect ratio for the given dimensions."""
-    target = width / height
-    best = "3:4"
-    best_diff = float("inf")
-    for ratio_str in ALLOWED_RATIOS:
-        w, h = map(int, ratio_str.split(":"))
-        diff = abs(target - w / h)
-        if diff < best_diff:
-            best_diff = diff
-            best = ratio_str
-    return best
-
-
-def resize_image(data: bytes) -> io.BytesIO:
-    """Resize image so longest side is MAX_DIMENSION. Returns JPEG BytesIO."""
-    img = Image.open(io.BytesIO(data)).convert("RGB")
-    img.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.LANCZOS)
-    buf = io.BytesIO()
-    img.save(buf, format="JPEG", quality=85)
-    buf.seek(0)
-    return buf
-
-
-def get_image_dimensions(data: bytes) -> tuple[int, int]:
-    """Get width and height of an image from bytes."""
-    img = Image.open(io.BytesIO(data))
-    return img.size
+# Async callback told which pipeline stage is starting (e.g. to push progress to a client)
+StageCallback = Callable[[str], Awaitable[None]]
 
 
 async def _download(url: str) -> bytes:
@@ -102,30 +71,137 @@ async def _download(url: str) -> bytes:
     return resp.content
 
 
-async def _prepare_image(url_or_path: str) -> io.BytesIO:
+def _local_path(url_or_path: str) -> Path:
+    """Map a URL served by this backend to its file; PHOTOS_DIR / RESULTS_DIR need not be under the cwd."""
+    for prefix, directory in ((f"{BASE_URL}/photos/", PHOTOS_DIR), (f"{BASE_URL}/results/", RESULTS_DIR)):
+        if url_or_path.startswith(prefix):
+            return Path(directory) / url_or_path[len(prefix):]
+    return Path(url_or_path)
+
+
+async def _prepare_image(
+    url_or_path: str,
+    buffers: memory.RequestBuffers,
+    max_dimension: int = MAX_DIMENSION,
+) -> io.BytesIO:
     """Prepare an image from either a local path or URL."""
-    local_path = url_or_path.replace("http://localhost:8000/", "")
-    if Path(local_path).exists():
-        raw = Path(local_path).read_bytes()
-    else:
-        raw = await _download(url_or_path)
-    return resize_image(raw)
+    raw = buffers.hold(await load_raw(url_or_path))
+    buf = (await asyncio.to_thread(imaging.prepare, raw, max_dimension)).buf
+    buffers.release(raw)
+    return buffers.hold(buf)
+
 
+def _read_local(path: Path) -> bytes | None:
+    return path.read_bytes() if path.exists() else None
 
-async def _load_raw(url_or_path: str) -> bytes:
+
+async def load_raw(url_or_path: str) -> bytes:
     """Load raw image bytes from URL or local path."""
-    local_path = url_or_path.replace("http://localhost:8000/", "")
-    if Path(local_path).exists():
-        return Path(local_path).read_bytes()
+    data = await asyncio.to_thread(_read_local, _local_path(url_or_path))
+    if data is not None:
+        return data
     return await _download(url_or_path)
 
 
+async def _cancel_prediction(creating: asyncio.Future) -> None:
+    """Cancel the prediction `creating` resolves to, once the create call returns."""
+    try:
+        prediction = await creating
+    except Exception:
+        return  # never created, nothing to cancel
+    await prediction.async_cancel()
+
+
+async def run_prediction(model: str, model_input: dict) -> str:
+    """
+    Run a Replicate prediction and return its output URL.
+
+    `model` is "owner/name" or "owner/name:version". Polls instead of using
+    replicate.run so that if the calling task is cancelled (e.g. the chat turn
+    was superseded) the prediction is cancelled on Replicate too, rather than
+    finishing and being billed for nothing.
+    """
+    async with scheduler.slot("replicate"):
+        if ":" in model:
+            create = replicate.predictions.async_create(version=model.split(":", 1)[1], input=model_input)
+        else:
+            create = replicate.models.predictions.async_create(model=model, input=model_input)
+        # Shielded so a cancel during the create call still gets hold of the
+        # prediction (which Replicate may already have started) to cancel it
+        creating = asyncio.ensure_future(create)
+        try:
+            prediction = await asyncio.shield(creating)
+            await prediction.async_wait()
+        except asyncio.CancelledError:
+            await asyncio.shield(_cancel_prediction(creating))
+            raise
+
+    if prediction.status != "succeeded":
+        raise RuntimeError(f"prediction {prediction.id} {prediction.status}: {prediction.error}")
+    output = prediction.output
+    return str(output[0] if isinstance(output, list) else output)
+
+
+async def report_stage(on_stage: StageCallback | None, stage: str) -> None:
+    if on_stage is not None:
+        await on_stage(stage)
+
+
+async def _stream_decode(url: str, keep_bytes: bool = False) -> tuple[Image.Image, bytes | None]:
+    """Download an image with a streamed response, decoding chunks as they arrive."""
+    decoder = imaging.StreamDecoder(keep_bytes)
+    async with httpx.AsyncClient() as client:
+        async with client.stream("GET", url) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.aiter_bytes():
+                decoder.feed(chunk)
+    # Whatever is still undecoded (all of it for WebP) is finished off-loop
+    return await asyncio.to_thread(decoder.close)
+
+
+async def _write_png(img: Image.Image, path: Path) -> None:
+    png = await asyncio.to_thread(imaging.encode_png, img)
+    await atomic_write_async(path, png)
+
+
+async def postprocess_result(raw_url: str, on_stage: StageCallback | None = None) -> str:
+    """
+    Stream a generated image through background removal into storage. Returns the result URL.
+
+    The output is decoded while it downloads, and the stored PNG and the
+    precomputed delivery variants are encoded in parallel from the same cutout.
+    """
+    await report_stage(on_stage, "removing_background")
+    async with memory.request_buffers("postprocess") as buffers:
+        # Only a remote rembg service needs the encoded bytes
+        img, data = await _stream_decode(raw_url, keep_bytes=bool(REMBG_SERVICE_URL))
+        buffers.hold(img)
+        if data is not None:
+            buffers.hold(data)
+
+        if degraded.use("skip_rembg"):
+            cutout = buffers.hold(img.convert("RGBA"))
+        else:
+            cutout = buffers.hold(await background.cut_out_async(img, data))
+        buffers.release(img, data)
+        del data
+
+        stem = f"tryon_{uuid.uuid4().hex[:8]}"
+        await asyncio.gather(
+            _write_png(cutout, Path(RESULTS_DIR) / f"{stem}.png"),
+            delivery.precompute_variants(cutout, stem),
+        )
+
+    return f"{BASE_URL}/results/{stem}.png"
+
+
 async def generate_tryon(
-    user_photo_url: str,
+    user_photo: PhotoArtifacts,
     outfit_description: str,
     outfit_image_url: str,
     previous_result_url: str | None = None,
     new_item_image_url: str | None = None,
+    on_stage: StageCallback | None = None,
 ) -> str:
     """
     Generate a try-on image with FLUX.2 Pro.
@@ -134,57 +210,54 @@ async def generate_tryon(
         - Initial: user photo + outfit image (2 images)
         - Layering: user photo + previous result + new item (3 images)
         - Text modify: user photo + previous result (2 images, new prompt)
+
+    The user photo's resized JPEG and aspect ratio come precomputed from its
+    upload (photo_artifacts), so only the other inputs are prepared here.
     """
     try:
-        # Compute aspect ratio from user photo to preserve proportions
-        user_raw = await _load_raw(user_photo_url)
-        user_w, user_h = get_image_dimensions(user_raw)
-        aspect_ratio = _pick_aspect_ratio(user_w, user_h)
-
-        user_buf = resize_image(user_raw)
-
-        if previous_result_url and new_item_image_url:
-            # Layering: user + current look + new item
-            prev_buf = await _prepare_image(previous_result_url)
-            new_buf = await _prepare_image(new_item_image_url)
-            input_images = [user_buf, prev_buf, new_buf]
-            prompt = LAYERING_PROMPT.format(description_delta=outfit_description)
-        elif previous_result_url:
-            # Text-only modification: user + current look
-            prev_buf = await _prepare_image(previous_result_url)
-            input_images = [user_buf, prev_buf]
-            prompt = TEXT_MODIFY_PROMPT.format(description=outfit_description)
-        else:
-            # Initial try-on: user + outfit reference
-            outfit_buf = await _prepare_image(outfit_image_url)
-            input_images = [user_buf, outfit_buf]
-            prompt = BASE_PROMPT.format(description=outfit_description)
-
-        output = await asyncio.to_thread(
-            replicate.run,
-            FLUX_MODEL,
-            input={
-                "prompt": prompt,
-                "input_images": input_images,
-                "aspect_ratio": aspect_ratio,
-                "output_format": "webp",
-                "output_quality": 90,
-                "safety_tolerance": 2,
-            },
-        )
-        raw_url = str(output)
-
-        # Post-process: download result and remove background
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(raw_url)
-            resp.raise_for_status()
-
-        nobg_bytes = await asyncio.to_thread(remove, resp.content, session=_rembg_session)
-
-        filename = f"tryon_{uuid.uuid4().hex[:8]}.png"
-        (RESULTS_DIR / filename).write_bytes(nobg_bytes)
-
-        return f"{BASE_URL}/results/{filename}"
+        async with memory.request_buffers("generate") as buffers:
+            aspect_ratio = user_photo.aspect_ratio
+            user_buf = buffers.hold(user_photo.as_input())
+
+            max_dimension, output_quality = MAX_DIMENSION, 90
+            if degraded.use("lower_quality"):
+                # The user photo keeps its precomputed size; the other inputs shrink
+                max_dimension, output_quality = DEGRADED_INPUT_MAX_DIMENSION, DEGRADED_OUTPUT_QUALITY
+
+            if previous_result_url and new_item_image_url:
+                # Layering: user + current look + new item
+                prev_buf = await _prepare_image(previous_result_url, buffers, max_dimension)
+                new_buf = await _prepare_image(new_item_image_url, buffers, max_dimension)
+                input_images = [user_buf, prev_buf, new_buf]
+                prompt = LAYERING_PROMPT.format(description_delta=outfit_description)
+            elif previous_result_url:
+                # Text-only modification: user + current look
+                prev_buf = await _prepare_image(previous_result_url, buffers, max_dimension)
+                input_images = [user_buf, prev_buf]
+                prompt = TEXT_MODIFY_PROMPT.format(description=outfit_description)
+            else:
+                # Initial try-on: user + outfit reference
+                outfit_buf = await _prepare_image(outfit_image_url, buffers, max_dimension)
+                input_images = [user_buf, outfit_buf]
+                prompt = BASE_PROMPT.format(description=outfit_description)
+
+            await report_stage(on_stage, "generating")
+            raw_url = await run_prediction(
+                FLUX_MODEL,
+                {
+                    "prompt": prompt,
+                    "input_images": input_images,
+                    "aspect_ratio": aspect_ratio,
+                    "output_format": "webp",
+                    "output_quality": output_quality,
+                    "safety_tolerance": 2,
+                },
+            )
+            # Inputs are uploaded by now; free them before the output download
+            buffers.release(*input_images)
+
+            # Post-process: download result and remove background
+            return await postprocess_result(raw_url, on_stage)
 
     except Exception as e:
         raise RuntimeError(f"FLUX generation failed: {e}") from e
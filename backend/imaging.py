@@ -0,0 +1,195 @@
+"""Image decode/resize helpers: draft-mode JPEG decoding and pluggable resampling."""
+
+import io
+from dataclasses import dataclass
+
+import PIL
+from PIL import Image, ImageFile, features
+
+from backend.config import (
+    MAX_DIMENSION, RESIZE_BACKEND, RESULT_AVIF_QUALITY, RESULT_WEBP_QUALITY,
+)
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # OpenCV is optional; Pillow is always available
+    cv2 = None
+    np = None
+
+# pillow-simd is a drop-in Pillow fork that publishes versions like "9.5.0.post1"
+PILLOW_SIMD = ".post" in PIL.__version__
+
+BACKENDS = ("pillow", "opencv")
+
+# Result formats the client can ask for: name -> (Pillow format, MIME type, extension)
+RESULT_FORMATS = {
+    "png": ("PNG", "image/png", "png"),
+    "webp": ("WEBP", "image/webp", "webp"),
+    "avif": ("AVIF", "image/avif", "avif"),
+}
+
+
+@dataclass
+class PreparedImage:
+    """A resized JPEG buffer plus the dimensions of the original image."""
+
+    buf: io.BytesIO
+    width: int
+    height: int
+
+
+def available_backends() -> list[str]:
+    """Resampling backends usable in this process."""
+    return [b for b in BACKENDS if b != "opencv" or cv2 is not None]
+
+
+def pick_backend(name: str = RESIZE_BACKEND) -> str:
+    """Resolve a backend name ("auto", "pillow", "opencv") to one that is installed."""
+    if name == "auto":
+        # pillow-simd already vectorises Pillow's own resampling, so prefer it
+        if PILLOW_SIMD or cv2 is None:
+            return "pillow"
+        return "opencv"
+    if name not in available_backends():
+        raise ValueError(f"Resize backend {name!r} is not available. Installed: {available_backends()}")
+    return name
+
+
+def fit_within(width: int, height: int, max_dimension: int = MAX_DIMENSION) -> tuple[int, int]:
+    """Scale (width, height) down so the longest side is at most max_dimension."""
+    longest = max(width, height)
+    if longest <= max_dimension:
+        return width, height
+    scale = max_dimension / longest
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def probe_size(data: bytes) -> tuple[int, int]:
+    """Read width and height from the image header without decoding pixels."""
+    with Image.open(io.BytesIO(data)) as img:
+        return img.size
+
+
+def decode(data: bytes, max_dimension: int = MAX_DIMENSION) -> tuple[Image.Image, tuple[int, int]]:
+    """
+    Decode an image to RGB, letting the JPEG decoder downscale in the DCT domain.
+
+    Returns the decoded image and the original (pre-draft) dimensions. The
+    decoded image is at least as large as the final target, so it still needs
+    a resize() pass.
+    """
+    img = Image.open(io.BytesIO(data))
+    original_size = img.size
+    # No-op for non-JPEG formats; for JPEG picks the largest 1/2, 1/4, 1/8
+    # scale that stays >= the target size, before any pixels are decoded
+    img.draft("RGB", fit_within(*original_size, max_dimension))
+    if img.mode != "RGB":
+        with img:
+            img = img.convert("RGB")
+    else:
+        img.load()
+    return img, original_size
+
+
+def resize(img: Image.Image, max_dimension: int = MAX_DIMENSION, backend: str = RESIZE_BACKEND) -> Image.Image:
+    """Resize so the longest side is max_dimension, using the selected backend."""
+    target = fit_within(*img.size, max_dimension)
+    if target == img.size:
+        return img
+    if pick_backend(backend) == "opencv":
+        arr = cv2.resize(np.asarray(img), target, interpolation=cv2.INTER_AREA)
+        return Image.fromarray(arr)
+    return img.resize(target, Image.LANCZOS, reducing_gap=2.0)
+
+
+def encode_jpeg(img: Image.Image, quality: int = 85) -> io.BytesIO:
+    """Encode an image as a JPEG BytesIO positioned at the start."""
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    buf.seek(0)
+    return buf
+
+
+def prepare(
+    data: bytes,
+    max_dimension: int = MAX_DIMENSION,
+    backend: str = RESIZE_BACKEND,
+    quality: int = 85,
+) -> PreparedImage:
+    """Decode once, resize and re-encode as JPEG, keeping the original dimensions."""
+    img, (width, height) = decode(data, max_dimension)
+    resized = resize(img, max_dimension, backend)
+    buf = encode_jpeg(resized, quality)
+    # Free the decoded pixels now rather than whenever the GC gets to them
+    if resized is not img:
+        resized.close()
+    img.close()
+    return PreparedImage(buf=buf, width=width, height=height)
+
+
+def encode_png(img: Image.Image) -> bytes:
+    """Encode an image as PNG bytes (fast settings, for stored results)."""
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class StreamDecoder:
+    """
+    Decode an image from chunks as they arrive.
+
+    Formats with an incremental decoder (JPEG, PNG) decode while the download
+    is still in flight; others (WebP) buffer in the parser and decode in
+    close(). The encoded bytes are only kept if keep_bytes is set.
+    """
+
+    def __init__(self, keep_bytes: bool = False) -> None:
+        self._parser = ImageFile.Parser()
+        self._chunks: list[bytes] | None = [] if keep_bytes else None
+
+    def feed(self, chunk: bytes) -> None:
+        self._parser.feed(chunk)
+        if self._chunks is not None:
+            self._chunks.append(chunk)
+
+    def close(self) -> tuple[Image.Image, bytes | None]:
+        """Finish decoding. Returns (loaded RGB image, encoded bytes or None)."""
+        img = self._parser.close()
+        if img.mode != "RGB":
+            with img:
+                img = img.convert("RGB")
+        else:
+            img.load()
+        data = b"".join(self._chunks) if self._chunks is not None else None
+        return img, data
+
+
+def result_format(name: str) -> str:
+    """Resolve a requested result format, falling back to WebP if AVIF isn't built in."""
+    if name == "avif" and not features.check("avif"):
+        return "webp"
+    return name
+
+
+def encode_result(img: Image.Image, name: str, max_dimension: int | None = None) -> tuple[bytes, str]:
+    """Encode a (transparent) result image in a client-negotiated format. Returns (bytes, MIME type)."""
+    name = result_format(name)
+    scaled = None
+    if max_dimension and max(img.size) > max_dimension:
+        img = scaled = img.resize(fit_within(*img.size, max_dimension), Image.LANCZOS, reducing_gap=2.0)
+
+    pil_format, mime, _ = RESULT_FORMATS[name]
+    options: dict = {}
+    if name == "webp":
+        options = {"quality": RESULT_WEBP_QUALITY, "method": 4}
+    elif name == "avif":
+        options = {"quality": RESULT_AVIF_QUALITY}
+    elif name == "png":
+        options = {"optimize": True}
+
+    buf = io.BytesIO()
+    img.save(buf, format=pil_format, **options)
+    if scaled is not None:
+        scaled.close()
+    return buf.getvalue(), mime
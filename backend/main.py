@@ -1,19 +1,26 @@
-import uuid
+import asyncio
+import base64
+import logging
 from pathlib import Path
 
-from fastapi import FastAPI, File, Query, UploadFile
+import anyio
+from fastapi import FastAPI, File, Query, Request, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 
-from backend.config import BASE_URL, PHOTOS_DIR, VALID_PHOTO_TYPES
+from backend.config import GENERATION_PHOTO_TYPES, PHOTOS_DIR, RESULTS_DIR, VALID_PHOTO_TYPES
+from backend import degraded, imaging, memory, metrics, photo_artifacts, scheduler, traces
+from backend.delivery import deliver_result
 from backend.models import (
-    ChatRequest, ChatResponse, HealthResponse,
+    ChatRequest, ChatResponse, HealthResponse, SessionMessage,
     TryOnRequest, TryOnResponse,
     UploadPhotoResponse, UserPhotosResponse,
 )
-from backend.pipeline import chat_modify, start_tryon
-from backend.storage import ensure_photos_dir, get_user_photos, save_photo
+from backend.pipeline import SupersededError, chat_modify, get_session, start_tryon
+from backend.storage import ensure_photos_dir, get_user_photos, new_photo_name, photo_url, save_outfit, save_photo
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="FitVision")
 
@@ -25,8 +32,8 @@ app.add_middleware(
 )
 
 ensure_photos_dir()
-Path("results").mkdir(exist_ok=True)
-app.mount("/results", StaticFiles(directory="results"), name="results")
+Path(RESULTS_DIR).mkdir(exist_ok=True)
+app.mount("/results", StaticFiles(directory=RESULTS_DIR), name="results")
 app.mount("/photos", StaticFiles(directory=PHOTOS_DIR), name="photos")
 
 
@@ -40,8 +47,21 @@ async def health() -> HealthResponse:
     return HealthResponse(status="ok")
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Rolling per-stage latency/error stats, counters (e.g. Gemini tokens), memory, degraded mode and scheduler queues."""
+    return {
+        "stages": metrics.snapshot(),
+        "counters": metrics.counters(),
+        "memory": memory.budget.snapshot(),
+        "degraded": degraded.snapshot(),
+        "scheduler": scheduler.snapshot(),
+    }
+
+
 @app.post("/upload-photo", response_model=UploadPhotoResponse)
 async def upload_photo(
+    http: Request,
     file: UploadFile = File(...),
     photo_type: str = Query(..., description="One of: face, upper_body, full_body"),
 ) -> UploadPhotoResponse:
@@ -51,8 +71,26 @@ async def upload_photo(
             content={"status": "error", "error": f"Invalid photo_type. Must be one of {VALID_PHOTO_TYPES}"},
         )
 
-    photo_url = await save_photo(file, photo_type)
-    return UploadPhotoResponse(status="uploaded", photo_type=photo_type, photo_url=photo_url)
+    content = await file.read()
+    filename = new_photo_name(photo_type, file.filename)
+    artifacts = None
+    # Decode before storing anything, so a bad upload doesn't replace a good photo
+    try:
+        if photo_type in GENERATION_PHOTO_TYPES:
+            # Derive everything generation needs from the photo once, not every turn
+            artifacts = await photo_artifacts.build(photo_url(filename), content)
+        else:
+            await asyncio.to_thread(imaging.probe_size, content)
+    except OSError as e:  # includes PIL.UnidentifiedImageError
+        return JSONResponse(status_code=400, content={"status": "error", "error": f"Invalid image: {e}"})
+
+    url = save_photo(photo_type, filename, content)
+    if artifacts is not None:
+        # The response waits on this and the user's first try-on needs it, so it
+        # queues like a try-on rather than as background work
+        scheduler.assign("tryon", scheduler.client_key(http))
+        await photo_artifacts.store(artifacts)
+    return UploadPhotoResponse(status="uploaded", photo_type=photo_type, photo_url=url)
 
 
 @app.get("/user-photos", response_model=UserPhotosResponse)
@@ -64,17 +102,15 @@ async def user_photos() -> UserPhotosResponse:
 @app.post("/upload-outfit")
 async def upload_outfit(file: UploadFile = File(...)):
     """Upload an outfit image file, returns a URL for use with /try-on or /chat."""
-    ensure_photos_dir()
     ext = Path(file.filename).suffix if file.filename else ".jpg"
-    filename = f"outfit_{uuid.uuid4().hex[:8]}{ext}"
-    filepath = Path(PHOTOS_DIR) / filename
     content = await file.read()
-    filepath.write_bytes(content)
-    return {"image_url": f"{BASE_URL}/photos/{filename}"}
+    return {"image_url": save_outfit(content, ext)}
 
 
 @app.post("/try-on", response_model=TryOnResponse)
-async def try_on(request: TryOnRequest) -> TryOnResponse:
+@traces.traced("/try-on")
+async def try_on(request: TryOnRequest, http: Request) -> TryOnResponse:
+    scheduler.assign("tryon", scheduler.client_key(http))
     photos = get_user_photos()
     user_photo_url = photos.get("full_body") or photos.get("upper_body")
 
@@ -84,38 +120,156 @@ async def try_on(request: TryOnRequest) -> TryOnResponse:
             error="No reference photo uploaded. Please upload a full body or upper body photo first.",
         )
 
+    applied = degraded.track()
     try:
         session = await start_tryon(
             image_url=request.image_url,
             user_photo_url=user_photo_url,
         )
+        delivered = await asyncio.to_thread(
+            deliver_result, session.current_result_url,
+            request.result_format, request.result_max_size, request.inline,
+        )
         return TryOnResponse(
             status="success",
             session_id=session.session_id,
-            tryon_image_url=session.current_result_url,
+            tryon_image_url=delivered.url,
+            tryon_image_data=delivered.data_url,
             description=session.current_description.description,
             fit_notes=session.current_description.fit_notes,
+            degraded=sorted(applied),
         )
     except RuntimeError as e:
-        return TryOnResponse(status="error", error=str(e))
+        return TryOnResponse(status="error", error=str(e), degraded=sorted(applied))
 
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest) -> ChatResponse:
+@traces.traced("/chat")
+async def chat(request: ChatRequest, http: Request) -> ChatResponse:
+    scheduler.assign("interactive", scheduler.client_key(http))
+    applied = degraded.track()
     try:
         session = await chat_modify(
             session_id=request.session_id,
             message=request.message,
             new_image_url=request.image_url,
         )
+        delivered = await asyncio.to_thread(
+            deliver_result, session.current_result_url,
+            request.result_format, request.result_max_size, request.inline,
+        )
         return ChatResponse(
             status="success",
             session_id=session.session_id,
-            tryon_image_url=session.current_result_url,
+            tryon_image_url=delivered.url,
+            tryon_image_data=delivered.data_url,
             description=session.current_description.description,
             fit_notes=session.current_description.fit_notes,
+            degraded=sorted(applied),
         )
+    except SupersededError as e:
+        return ChatResponse(status="superseded", session_id=request.session_id, error=str(e))
     except ValueError as e:
         return ChatResponse(status="error", error=str(e))
     except RuntimeError as e:
-        return ChatResponse(status="error", error=str(e))
+        return ChatResponse(status="error", error=str(e), degraded=sorted(applied))
+
+
+async def _send_frame(websocket: WebSocket, frame: dict) -> None:
+    """Send a frame unless the client has already gone; a closed socket isn't an error here."""
+    try:
+        await websocket.send_json(frame)
+    except (WebSocketDisconnect, RuntimeError, anyio.ClosedResourceError):
+        pass
+
+
+async def _session_turn(websocket: WebSocket, session_id: str, msg: SessionMessage) -> None:
+    """Run one chat turn for the session channel, pushing progress and the result."""
+
+    async def on_stage(stage: str) -> None:
+        await websocket.send_json({"type": "progress", "stage": stage})
+
+    scheduler.assign("interactive", scheduler.client_key(websocket))
+    async with traces.capture("ws:chat", msg) as trace:
+        trace.inputs["session_id"] = traces.hash_value(session_id)
+        applied = degraded.track()
+        try:
+            image_url = msg.image_url
+            if msg.image_data:
+                image_url = save_outfit(base64.b64decode(msg.image_data))
+
+            session = await chat_modify(
+                session_id=session_id,
+                message=msg.message,
+                new_image_url=image_url,
+                on_stage=on_stage,
+            )
+            delivered = await asyncio.to_thread(
+                deliver_result, session.current_result_url,
+                msg.result_format, msg.result_max_size, msg.inline,
+            )
+            response = ChatResponse(
+                status="success",
+                session_id=session.session_id,
+                tryon_image_url=delivered.url,
+                tryon_image_data=delivered.data_url,
+                description=session.current_description.description,
+                fit_notes=session.current_description.fit_notes,
+                degraded=sorted(applied),
+            )
+            trace.status = "success"
+            await _send_frame(websocket, {"type": "result", **response.model_dump()})
+        except SupersededError:
+            trace.status = "superseded"
+            await _send_frame(websocket, {"type": "cancelled"})
+        except (ValueError, RuntimeError) as e:
+            trace.status = "error"
+            await _send_frame(websocket, {"type": "error", "error": str(e)})
+        except WebSocketDisconnect:
+            trace.status = "disconnected"
+        except Exception as e:
+            # Anything else (httpx, Pillow, ...) still ends the turn with an error frame,
+            # so the client stops waiting; CancelledError is not an Exception and propagates
+            logger.exception("Chat turn failed in session %s", session_id)
+            trace.status = "error"
+            await _send_frame(websocket, {"type": "error", "error": f"Chat turn failed: {e}"})
+        trace.degraded = sorted(applied)
+
+
+@app.websocket("/ws/sessions/{session_id}")
+async def session_channel(websocket: WebSocket, session_id: str) -> None:
+    """
+    Persistent chat channel bound to one try-on session.
+
+    Client sends {"type": "chat", ...} or {"type": "cancel"} frames (see
+    SessionMessage). Server pushes {"type": "progress", "stage"}, "result",
+    "cancelled" and "error" frames. A new chat frame supersedes the turn still
+    running (see pipeline.chat_modify), so it stops instead of running to
+    completion; a cancel frame stops it without starting another.
+    """
+    await websocket.accept()
+    if await get_session(session_id) is None:
+        await websocket.send_json({"type": "error", "error": f"Session {session_id} not found or expired"})
+        await websocket.close()
+        return
+
+    turn: asyncio.Task | None = None
+    try:
+        while True:
+            try:
+                msg = SessionMessage.model_validate(await websocket.receive_json())
+            except ValueError as e:
+                await websocket.send_json({"type": "error", "error": f"Invalid message: {e}"})
+                continue
+
+            if msg.type == "cancel":
+                if turn is not None and not turn.done():
+                    turn.cancel()
+                    await websocket.send_json({"type": "cancelled"})
+            else:
+                turn = asyncio.create_task(_session_turn(websocket, session_id, msg))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if turn is not None and not turn.done():
+            turn.cancel()
@@ -0,0 +1,147 @@
+"""Accounting for live image buffers: per-request tracking, a global budget and RSS metrics.
+
+Every generation holds several encoded/decoded images at once (raw upload,
+resized inputs, the FLUX download, the rembg output). Requests register those
+buffers with a RequestBuffers tracker and release each one as soon as its
+stage is done. New requests wait at admission while the process-wide total
+is over MEMORY_BUDGET_BYTES; requests already running never block, so the
+budget can't deadlock.
+"""
+
+import asyncio
+import io
+import itertools
+import sys
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from PIL import Image
+
+from backend.config import MEMORY_BUDGET_BYTES
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def buffer_size(obj: object) -> int:
+    """Bytes held by an image buffer (bytes, BytesIO or decoded PIL image)."""
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return len(obj)
+    if isinstance(obj, io.BytesIO):
+        return 0 if obj.closed else obj.getbuffer().nbytes
+    if isinstance(obj, Image.Image):
+        return obj.width * obj.height * len(obj.getbands())
+    return sys.getsizeof(obj)
+
+
+class MemoryBudget:
+    def __init__(self, limit_bytes: int) -> None:
+        self.limit_bytes = limit_bytes
+        self.live_bytes = 0
+        self.peak_live_bytes = 0
+        self.waiting = 0
+        self.requests: dict[str, "RequestBuffers"] = {}
+        self._changed = asyncio.Event()
+
+    def _add(self, nbytes: int) -> None:
+        self.live_bytes += nbytes
+        self.peak_live_bytes = max(self.peak_live_bytes, self.live_bytes)
+        if nbytes < 0:
+            self._changed.set()
+
+    async def admit(self) -> None:
+        """Wait until live buffers are under the limit (limit <= 0 disables the budget)."""
+        if self.limit_bytes <= 0:
+            return
+        self.waiting += 1
+        try:
+            while self.live_bytes >= self.limit_bytes:
+                self._changed.clear()
+                await self._changed.wait()
+        finally:
+            self.waiting -= 1
+
+    def snapshot(self) -> dict:
+        return {
+            "budget_bytes": self.limit_bytes,
+            "live_bytes": self.live_bytes,
+            "peak_live_bytes": self.peak_live_bytes,
+            "waiting_requests": self.waiting,
+            "requests": {name: r.nbytes for name, r in self.requests.items()},
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+
+
+class RequestBuffers:
+    """The image buffers one request is holding, counted against a MemoryBudget."""
+
+    def __init__(self, name: str, budget: MemoryBudget) -> None:
+        self.name = name
+        self.budget = budget
+        self._held: dict[int, tuple[object, int]] = {}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(size for _, size in self._held.values())
+
+    def hold(self, obj):
+        """Start counting a buffer; returns it unchanged for inline use."""
+        if id(obj) not in self._held:
+            size = buffer_size(obj)
+            self._held[id(obj)] = (obj, size)
+            self.budget._add(size)
+        return obj
+
+    def release(self, *objs: object) -> None:
+        """Stop counting buffers and close them (BytesIO / PIL images) so memory is freed now."""
+        for obj in objs:
+            entry = self._held.pop(id(obj), None)
+            if entry is None:
+                continue
+            self.budget._add(-entry[1])
+            if isinstance(obj, (io.BytesIO, Image.Image)):
+                obj.close()
+
+    def release_all(self) -> None:
+        self.release(*[obj for obj, _ in list(self._held.values())])
+
+
+budget = MemoryBudget(MEMORY_BUDGET_BYTES)
+_current: ContextVar[RequestBuffers | None] = ContextVar("request_buffers", default=None)
+_ids = itertools.count(1)
+
+
+@asynccontextmanager
+async def request_buffers(kind: str, budget: MemoryBudget = budget):
+    """
+    Track one request's image buffers; everything still held is released on exit.
+
+    Nested calls (e.g. post-processing inside a generation) share the outer
+    tracker and skip admission.
+    """
+    outer = _current.get()
+    if outer is not None:
+        yield outer
+        return
+
+    await budget.admit()
+    buffers = RequestBuffers(f"{kind}-{next(_ids)}", budget)
+    budget.requests[buffers.name] = buffers
+    token = _current.set(buffers)
+    try:
+        yield buffers
+    finally:
+        _current.reset(token)
+        buffers.release_all()
+        del budget.requests[buffers.name]
+
+
+def peak_rss_bytes() -> int | None:
+    """Peak resident set size of this process, if the platform reports it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
@@ -0,0 +1,100 @@
+"""Rolling latency/error statistics for pipeline stages and generation providers."""
+
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+
+from backend import traces
+
+# Number of recent calls each stage keeps for percentiles and error rate
+WINDOW = 50
+
+
+@dataclass
+class StageStats:
+    samples: deque = field(default_factory=lambda: deque(maxlen=WINDOW))  # (seconds, ok)
+    calls: int = 0
+    failures: int = 0
+    # time.monotonic() at which each sample was recorded, parallel to samples
+    recorded_at: deque = field(default_factory=lambda: deque(maxlen=WINDOW), repr=False)
+
+    def record(self, seconds: float, ok: bool) -> None:
+        self.samples.append((seconds, ok))
+        self.recorded_at.append(time.monotonic())
+        self.calls += 1
+        if not ok:
+            self.failures += 1
+
+    def recent(self, seconds: float) -> "StageStats":
+        """Stats over just the samples recorded in the last `seconds`."""
+        cutoff = time.monotonic() - seconds
+        recent = [s for s, at in zip(self.samples, self.recorded_at) if at >= cutoff]
+        return StageStats(samples=deque(recent, maxlen=WINDOW))
+
+    def percentile(self, q: float) -> float | None:
+        """Latency percentile (0-100) over the window, or None with no samples."""
+        if not self.samples:
+            return None
+        latencies = sorted(s for s, _ in self.samples)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q / 100))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "window": len(self.samples),
+            "p50_s": self.percentile(50),
+            "p95_s": self.percentile(95),
+            "error_rate": round(self.error_rate, 3),
+        }
+
+
+_stages: dict[str, StageStats] = {}
+_counters: dict[str, int] = {}
+
+
+def stage(name: str) -> StageStats:
+    """Get (or create) the stats for a named stage, e.g. "provider.flux"."""
+    if name not in _stages:
+        _stages[name] = StageStats()
+    return _stages[name]
+
+
+@asynccontextmanager
+async def timed(name: str):
+    """
+    Time the enclosed block into stage(name); exceptions count as failures (cancellation doesn't).
+
+    The timing is also added to the current request's trace, if one is being captured.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        seconds = time.perf_counter() - start
+        stage(name).record(seconds, ok=False)
+        traces.record_stage(name, start, seconds, ok=False)
+        raise
+    seconds = time.perf_counter() - start
+    stage(name).record(seconds, ok=True)
+    traces.record_stage(name, start, seconds, ok=True)
+
+
+def count(name: str, value: int = 1) -> None:
+    """Add to a monotonically increasing counter, e.g. "gemini.classify.input_tokens"."""
+    _counters[name] = _counters.get(name, 0) + value
+
+
+def counters() -> dict[str, int]:
+    return dict(sorted(_counters.items()))
+
+
+def snapshot() -> dict[str, dict]:
+    return {name: s.snapshot() for name, s in sorted(_stages.items())}
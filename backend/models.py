@@ -1,4 +1,11 @@
-from pydantic import BaseModel
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+ResultFormat = Literal["png", "webp", "avif"]
+
+# Largest result_max_size accepted; generated results are at most ~2048px on a side
+RESULT_MAX_SIZE_LIMIT = 4096
 
 
 class UploadPhotoResponse(BaseModel):
@@ -15,30 +22,53 @@ class UserPhotosResponse(BaseModel):
 
 class TryOnRequest(BaseModel):
     image_url: str
+    result_format: ResultFormat = "png"
+    result_max_size: int | None = Field(default=None, gt=0, le=RESULT_MAX_SIZE_LIMIT)
+    inline: bool = False
 
 
 class TryOnResponse(BaseModel):
     status: str
     session_id: str | None = None
     tryon_image_url: str | None = None
+    tryon_image_data: str | None = None
     description: str | None = None
     fit_notes: str | None = None
     error: str | None = None
+    # Degraded-mode shortcuts taken for this request (empty in normal mode)
+    degraded: list[str] = []
 
 
 class ChatRequest(BaseModel):
     session_id: str
     message: str
     image_url: str | None = None
+    result_format: ResultFormat = "png"
+    result_max_size: int | None = Field(default=None, gt=0, le=RESULT_MAX_SIZE_LIMIT)
+    inline: bool = False
 
 
 class ChatResponse(BaseModel):
     status: str
     session_id: str | None = None
     tryon_image_url: str | None = None
+    tryon_image_data: str | None = None
     description: str | None = None
     fit_notes: str | None = None
     error: str | None = None
+    # Degraded-mode shortcuts taken for this request (empty in normal mode)
+    degraded: list[str] = []
+
+
+class SessionMessage(BaseModel):
+    """Client → server frame on the /ws/sessions/{session_id} channel."""
+    type: Literal["chat", "cancel"]
+    message: str = ""
+    image_url: str | None = None
+    image_data: str | None = None  # base64-encoded garment image, instead of image_url
+    result_format: ResultFormat = "png"
+    result_max_size: int | None = Field(default=None, gt=0, le=RESULT_MAX_SIZE_LIMIT)
+    inline: bool = False
 
 
 class ClassificationResult(BaseModel):
@@ -0,0 +1,180 @@
+"""Per-photo artifacts for the user's reference photo, computed once at upload.
+
+Every generation needs the same things from the reference photo: a resized
+JPEG, the original dimensions and the FLUX aspect ratio that matches them.
+They are derived in /upload-photo before the photo itself is stored (so an
+undecodable upload is rejected without replacing the previous photo), kept
+under PHOTOS_DIR/artifacts so every worker can load them, and turns read
+them from memory instead of re-decoding the photo.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+import replicate
+
+from backend import imaging, scheduler
+from backend.config import MAX_DIMENSION, PHOTOS_DIR, REPLICATE_UPLOAD_USER_PHOTOS
+from backend.storage import atomic_write
+
+ARTIFACTS_DIR = Path(PHOTOS_DIR) / "artifacts"
+
+ALLOWED_RATIOS = [
+    "1:1", "4:3", "3:4", "16:9", "9:16",
+    "3:2", "2:3", "4:5", "5:4", "21:9", "9:21",
+]
+
+
+def _pick_aspect_ratio(width: int, height: int) -> str:
+    """Pick the closest FLUX-supported aspect ratio for the given dimensions."""
+    target = width / height
+    best = "3:4"
+    best_diff = float("inf")
+    for ratio_str in ALLOWED_RATIOS:
+        w, h = map(int, ratio_str.split(":"))
+        diff = abs(target - w / h)
+        if diff < best_diff:
+            best_diff = diff
+            best = ratio_str
+    return best
+
+
+@dataclass
+class PhotoArtifacts:
+    url: str
+    content_hash: str
+    width: int
+    height: int
+    aspect_ratio: str
+    # The photo resized to MAX_DIMENSION and re-encoded as JPEG
+    jpeg: bytes = field(repr=False)
+    # Replicate file API handle for the JPEG, if REPLICATE_UPLOAD_USER_PHOTOS
+    replicate_url: str | None = None
+    replicate_expires_at: str | None = None
+
+    def as_input(self) -> io.BytesIO | str:
+        """Replicate input for this photo: the uploaded file's URL while valid, else a buffer over the JPEG."""
+        if self.replicate_url and not _expired(self.replicate_expires_at):
+            return self.replicate_url
+        return io.BytesIO(self.jpeg)
+
+
+# Photo URL -> artifacts, for photos this worker has built or loaded
+_cache: dict[str, PhotoArtifacts] = {}
+
+
+def _expired(expires_at: str | None) -> bool:
+    if expires_at is None:
+        return False
+    return datetime.fromisoformat(expires_at.replace("Z", "+00:00")) <= datetime.now(timezone.utc)
+
+
+def _photo_name(url: str) -> str:
+    return url.rsplit("/", 1)[-1]
+
+
+def _build(url: str, data: bytes) -> PhotoArtifacts:
+    """Derive the artifacts from a photo's bytes. Blocking; raises OSError if it isn't a readable image."""
+    prepared = imaging.prepare(data, MAX_DIMENSION)
+    return PhotoArtifacts(
+        url=url,
+        content_hash=hashlib.sha256(data).hexdigest(),
+        width=prepared.width,
+        height=prepared.height,
+        aspect_ratio=_pick_aspect_ratio(prepared.width, prepared.height),
+        jpeg=prepared.buf.getvalue(),
+    )
+
+
+def _save(artifacts: PhotoArtifacts) -> None:
+    ARTIFACTS_DIR.mkdir(parents=True, exist_ok=True)
+    name = _photo_name(artifacts.url)
+    meta = {k: v for k, v in asdict(artifacts).items() if k != "jpeg"}
+    atomic_write(ARTIFACTS_DIR / f"{name}.jpg", artifacts.jpeg)
+    atomic_write(ARTIFACTS_DIR / f"{name}.json", json.dumps(meta).encode())
+
+
+def _load(url: str) -> PhotoArtifacts | None:
+    """Artifacts stored by any worker, or None if the photo has none (yet)."""
+    name = _photo_name(url)
+    try:
+        meta = json.loads((ARTIFACTS_DIR / f"{name}.json").read_bytes())
+        jpeg = (ARTIFACTS_DIR / f"{name}.jpg").read_bytes()
+    except FileNotFoundError:
+        return None
+    return PhotoArtifacts(**meta, jpeg=jpeg)
+
+
+def _prune() -> list[str]:
+    """Delete artifacts of photos that have since been replaced. Returns their photo names."""
+    removed = []
+    for path in ARTIFACTS_DIR.glob("*.json"):
+        name = path.name.removesuffix(".json")
+        if not (Path(PHOTOS_DIR) / name).exists():
+            path.unlink(missing_ok=True)
+            (ARTIFACTS_DIR / f"{name}.jpg").unlink(missing_ok=True)
+            removed.append(name)
+    return removed
+
+
+async def _upload(artifacts: PhotoArtifacts) -> None:
+    """Upload the JPEG to Replicate's file API so turns can pass a URL instead of the bytes."""
+    try:
+        async with scheduler.slot("replicate"):
+            uploaded = await replicate.files.async_create(
+                io.BytesIO(artifacts.jpeg),
+                filename=f"{artifacts.content_hash[:16]}.jpg",
+                content_type="image/jpeg",
+            )
+    except (replicate.exceptions.ReplicateError, httpx.HTTPError):
+        return  # optional: turns fall back to sending the JPEG bytes
+    artifacts.replicate_url = uploaded.urls["get"]
+    artifacts.replicate_expires_at = uploaded.expires_at
+
+
+async def build(url: str, data: bytes) -> PhotoArtifacts:
+    """
+    Derive the artifacts for a photo that will be stored at `url`, without storing anything.
+
+    Raises PIL.UnidentifiedImageError (an OSError) or OSError if data isn't a readable image.
+    """
+    return await asyncio.to_thread(_build, url, data)
+
+
+async def store(artifacts: PhotoArtifacts) -> PhotoArtifacts:
+    """Store built artifacts once their photo is saved, dropping those of replaced photos."""
+    if REPLICATE_UPLOAD_USER_PHOTOS:
+        await _upload(artifacts)
+    await asyncio.to_thread(_save, artifacts)
+    removed = await asyncio.to_thread(_prune)
+    for stale in [u for u in _cache if _photo_name(u) in removed]:
+        del _cache[stale]
+    _cache[artifacts.url] = artifacts
+    return artifacts
+
+
+async def _create(url: str) -> PhotoArtifacts:
+    """Build and store artifacts for a photo that was saved without them."""
+    try:
+        data = await asyncio.to_thread((Path(PHOTOS_DIR) / _photo_name(url)).read_bytes)
+        artifacts = await build(url, data)
+    except OSError as e:
+        raise RuntimeError(f"Reference photo can't be used: {e}") from e
+    return await store(artifacts)
+
+
+async def get(url: str) -> PhotoArtifacts:
+    """Artifacts for a photo: from memory, from disk, or built now for photos uploaded before they existed."""
+    artifacts = _cache.get(url)
+    if artifacts is None:
+        artifacts = await asyncio.to_thread(_load, url)
+        if artifacts is None:
+            return await _create(url)
+        _cache[url] = artifacts
+    return artifacts
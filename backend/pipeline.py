@@ -1,13 +1,18 @@
 """Session management and orchestration: classify → generate → chat loop."""
 
+import asyncio
 import uuid
 from dataclasses import dataclass, field
-from datetime import datetime
+from datetime import datetime, timedelta
 
+from backend import photo_artifacts
 from backend.classifier import classify_image, update_description
 from backend.config import SESSION_TTL_SECONDS
-from backend.flux_tryon import generate_tryon
+from backend.flux_tryon import StageCallback
 from backend.models import ClassificationResult
+from backend.photo_artifacts import PhotoArtifacts
+from backend.providers import run_generation
+from backend.session_store import open_store
 
 
 @dataclass
@@ -19,34 +24,100 @@ class Session:
     current_result_url: str
     chat_history: list[dict[str, str]] = field(default_factory=list)
     created_at: datetime = field(default_factory=datetime.utcnow)
+    last_active: datetime = field(default_factory=datetime.utcnow)
+    # Precomputed artifacts of user_photo_url, loaded by the first turn on this worker
+    user_photo: PhotoArtifacts | None = field(default=None, repr=False)
+    # Serializes chat turns; active_turn is the newest turn, older ones get cancelled
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+    active_turn: asyncio.Task | None = field(default=None, repr=False)
+    # Newest generation claimed by a turn on this worker
+    claimed_generation: int = field(default=0, repr=False)
 
 
+class SupersededError(RuntimeError):
+    """A chat turn was cancelled because a newer message arrived for the same session."""
+
+
+# Persisted session records (shared across workers with SESSION_STORE=sqlite)
+_store = open_store()
+# Hot per-process Session objects: locks and running turns can't be persisted
 _sessions: dict[str, Session] = {}
 
 
-def get_session(session_id: str) -> Session | None:
-    return _sessions.get(session_id)
+def _to_record(session: Session) -> dict:
+    return {
+        "user_photo_url": session.user_photo_url,
+        "original_image_url": session.original_image_url,
+        "current_description": session.current_description.model_dump(),
+        "current_result_url": session.current_result_url,
+        "chat_history": session.chat_history,
+        "created_at": session.created_at.isoformat(),
+    }
+
+
+def _apply_record(session: Session, record: dict) -> None:
+    """Refresh a hot Session from its stored record (another worker may have updated it)."""
+    session.user_photo_url = record["user_photo_url"]
+    session.original_image_url = record["original_image_url"]
+    session.current_description = ClassificationResult(**record["current_description"])
+    session.current_result_url = record["current_result_url"]
+    session.chat_history = record["chat_history"]
+    session.created_at = datetime.fromisoformat(record["created_at"])
+
+
+async def get_session(session_id: str) -> Session | None:
+    record = await _store.get(session_id)
+    if record is None:
+        _sessions.pop(session_id, None)
+        return None
+
+    session = _sessions.get(session_id)
+    if session is None:
+        session = Session(
+            session_id=session_id,
+            user_photo_url=record["user_photo_url"],
+            original_image_url=record["original_image_url"],
+            current_description=ClassificationResult(**record["current_description"]),
+            current_result_url=record["current_result_url"],
+        )
+        _sessions[session_id] = session
+    _apply_record(session, record)
+    session.last_active = datetime.utcnow()
+    return session
+
 
+def _prune_local() -> None:
+    """
+    Drop hot Sessions idle on this worker for longer than TTL.
 
-def _cleanup_expired() -> None:
-    """Remove sessions older than TTL."""
-    now = datetime.utcnow()
-    expired = [
-        sid for sid, s in _sessions.items()
-        if (now - s.created_at).total_seconds() > SESSION_TTL_SECONDS
-    ]
-    for sid in expired:
-        del _sessions[sid]
+    Independent of the store: another worker may have expired (or deleted) a
+    session first, and this worker would never hear about it. A session that
+    is still active elsewhere is simply reloaded from the store on next use.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=SESSION_TTL_SECONDS)
+    for sid, session in list(_sessions.items()):
+        if session.last_active < cutoff and (session.active_turn is None or session.active_turn.done()):
+            del _sessions[sid]
+
+
+async def _cleanup_expired() -> None:
+    """Remove sessions idle for longer than TTL."""
+    for sid in await _store.expire(SESSION_TTL_SECONDS):
+        _sessions.pop(sid, None)
+    _prune_local()
 
 
 async def start_tryon(image_url: str, user_photo_url: str) -> Session:
-    """Initial try-on: classify image → FLUX generate → create session."""
-    _cleanup_expired()
+    """Initial try-on: classify image → generate (routed provider) → create session."""
+    await _cleanup_expired()
 
-    classification = await classify_image(image_url)
+    classification, user_photo = await asyncio.gather(
+        classify_image(image_url),
+        photo_artifacts.get(user_photo_url),
+    )
 
-    result_url = await generate_tryon(
-        user_photo_url=user_photo_url,
+    result_url = await run_generation(
+        user_photo=user_photo,
         outfit_description=classification.description,
         outfit_image_url=image_url,
     )
@@ -58,7 +129,9 @@ async def start_tryon(image_url: str, user_photo_url: str) -> Session:
         original_image_url=image_url,
         current_description=classification,
         current_result_url=result_url,
+        user_photo=user_photo,
     )
+    await _store.create(session_id, _to_record(session))
     _sessions[session_id] = session
     return session
 
@@ -67,39 +140,101 @@ async def chat_modify(
     session_id: str,
     message: str,
     new_image_url: str | None = None,
+    on_stage: StageCallback | None = None,
 ) -> Session:
-    """Chat modification: update description → regenerate."""
-    session = get_session(session_id)
+    """
+    Chat modification: update description → regenerate.
+
+    Turns are serialized per session, and a newer turn cancels the one in
+    flight (including its Replicate prediction). The superseded caller gets
+    SupersededError; its result is never written to the session. Across
+    workers, the store's generation check keeps an older turn from
+    committing over a newer one.
+    """
+    _prune_local()
+    session = await get_session(session_id)
     if session is None:
         raise ValueError(f"Session {session_id} not found or expired")
 
-    updated = await update_description(
-        current_description=session.current_description.description,
-        user_message=message,
-        new_image_url=new_image_url,
-    )
-
-    if new_image_url:
-        # Layering: pass previous result + new item
-        result_url = await generate_tryon(
-            user_photo_url=session.user_photo_url,
-            outfit_description=updated.description,
-            outfit_image_url=session.original_image_url,
-            previous_result_url=session.current_result_url,
-            new_item_image_url=new_image_url,
-        )
-    else:
-        # Text-only modification: user photo + previous result with new prompt
-        result_url = await generate_tryon(
-            user_photo_url=session.user_photo_url,
-            outfit_description=updated.description,
-            outfit_image_url=session.original_image_url,
-            previous_result_url=session.current_result_url,
+    generation = await _store.claim(session_id)
+    if generation is None:
+        raise ValueError(f"Session {session_id} not found or expired")
+    if generation < session.claimed_generation:
+        # A newer message claimed the session while our claim was in flight
+        raise SupersededError(f"Superseded by a newer message in session {session_id}")
+    session.claimed_generation = generation
+    turn = asyncio.create_task(_run_turn(session, generation, message, new_image_url, on_stage))
+    previous, session.active_turn = session.active_turn, turn
+    if previous is not None and not previous.done():
+        previous.cancel()
+
+    try:
+        return await turn
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            raise  # our own caller was cancelled (e.g. the client went away)
+        raise SupersededError(f"Superseded by a newer message in session {session_id}") from None
+
+
+async def _run_turn(
+    session: Session,
+    generation: int,
+    message: str,
+    new_image_url: str | None,
+    on_stage: StageCallback | None,
+) -> Session:
+    """One chat turn, run under the session lock so state reads and writes don't interleave."""
+    async with session.lock:
+        # Pick up anything a turn on another worker committed while we waited
+        record = await _store.get(session.session_id)
+        if record is None:
+            _sessions.pop(session.session_id, None)
+            raise ValueError(f"Session {session.session_id} not found or expired")
+        _apply_record(session, record)
+        if session.user_photo is None or session.user_photo.url != session.user_photo_url:
+            session.user_photo = await photo_artifacts.get(session.user_photo_url)
+
+        if on_stage is not None:
+            await on_stage("describing")
+        updated = await update_description(
+            current_description=session.current_description.description,
+            user_message=message,
+            new_image_url=new_image_url,
         )
 
-    session.chat_history.append({"role": "user", "content": message})
-    session.chat_history.append({"role": "assistant", "content": updated.description})
-    session.current_description = updated
-    session.current_result_url = result_url
+        if new_image_url:
+            # Layering: pass previous result + new item
+            result_url = await run_generation(
+                user_photo=session.user_photo,
+                outfit_description=updated.description,
+                outfit_image_url=session.original_image_url,
+                previous_result_url=session.current_result_url,
+                new_item_image_url=new_image_url,
+                on_stage=on_stage,
+            )
+        else:
+            # Text-only modification: user photo + previous result with new prompt
+            result_url = await run_generation(
+                user_photo=session.user_photo,
+                outfit_description=updated.description,
+                outfit_image_url=session.original_image_url,
+                previous_result_url=session.current_result_url,
+                on_stage=on_stage,
+            )
+
+        # Stale-result suppression: never overwrite state with a superseded turn
+        if session.active_turn is not asyncio.current_task():
+            raise SupersededError(f"Superseded by a newer message in session {session.session_id}")
+
+        record = _to_record(session)
+        record["chat_history"] = session.chat_history + [
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": updated.description},
+        ]
+        record["current_description"] = updated.model_dump()
+        record["current_result_url"] = result_url
+        if not await _store.commit(session.session_id, record, generation):
+            raise SupersededError(f"Superseded by a newer message in session {session.session_id}")
+        _apply_record(session, record)
 
     return session
@@ -0,0 +1,150 @@
+"""Generation providers (FLUX.2 Pro, IDM-VTON) and a latency/cost-aware router with fallback."""
+
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+from backend import degraded, metrics
+from backend.config import (
+    GENERATION_COST_BUDGET_USD, GENERATION_LATENCY_BUDGET_S, GENERATION_PROVIDERS,
+    IDMVTON_CATEGORY,
+)
+from backend.flux_tryon import StageCallback, generate_tryon, postprocess_result, report_stage
+from backend.photo_artifacts import PhotoArtifacts
+from backend.tryon import run_tryon
+
+# A provider is marked unhealthy (tried last) above this error rate...
+UNHEALTHY_ERROR_RATE = 0.5
+# ...once it has at least this many calls in its stats window
+MIN_SAMPLES = 4
+
+
+@dataclass
+class Provider:
+    name: str
+    cost_usd: float
+    modes: frozenset[str]
+    # Same signature as flux_tryon.generate_tryon; returns the stored result URL
+    generate: Callable[..., Awaitable[str]]
+
+    @property
+    def stats(self) -> metrics.StageStats:
+        return metrics.stage(f"provider.{self.name}")
+
+    def healthy(self) -> bool:
+        stats = self.stats
+        return len(stats.samples) < MIN_SAMPLES or stats.error_rate < UNHEALTHY_ERROR_RATE
+
+    def expected_latency(self) -> float | None:
+        stats = self.stats
+        return stats.percentile(50) if len(stats.samples) >= MIN_SAMPLES else None
+
+
+def generation_mode(previous_result_url: str | None, new_item_image_url: str | None) -> str:
+    """Classify a request as "initial", "layering" or "text_modify" (generate_tryon's modes)."""
+    if previous_result_url and new_item_image_url:
+        return "layering"
+    if previous_result_url:
+        return "text_modify"
+    return "initial"
+
+
+async def _idm_vton(
+    user_photo: PhotoArtifacts,
+    outfit_description: str,
+    outfit_image_url: str,
+    previous_result_url: str | None = None,
+    new_item_image_url: str | None = None,
+    on_stage: StageCallback | None = None,
+) -> str:
+    """IDM-VTON only dresses a person in one garment image, so it only serves initial try-ons."""
+    await report_stage(on_stage, "generating")
+    raw_url = await run_tryon(
+        human_img_url=user_photo.url,
+        human_img=user_photo.as_input(),
+        garm_img_url=outfit_image_url,
+        category=IDMVTON_CATEGORY,
+        garment_des=outfit_description,
+    )
+    try:
+        return await postprocess_result(raw_url, on_stage)
+    except Exception as e:
+        raise RuntimeError(f"IDM-VTON post-processing failed: {e}") from e
+
+
+PROVIDERS: dict[str, Provider] = {
+    "flux": Provider(
+        name="flux",
+        cost_usd=0.08,
+        modes=frozenset({"initial", "layering", "text_modify"}),
+        generate=generate_tryon,
+    ),
+    "idm-vton": Provider(
+        name="idm-vton",
+        cost_usd=0.03,
+        modes=frozenset({"initial"}),
+        generate=_idm_vton,
+    ),
+}
+
+
+def route(
+    mode: str,
+    latency_budget_s: float = GENERATION_LATENCY_BUDGET_S,
+    cost_budget_usd: float = GENERATION_COST_BUDGET_USD,
+) -> list[Provider]:
+    """
+    Order the enabled providers that support `mode` for one attempt each.
+
+    Preference order comes from GENERATION_PROVIDERS. Providers over the cost
+    budget are dropped (unless nothing else can serve the mode); unhealthy
+    providers and those whose recent p50 exceeds the latency budget move to
+    the back, so they are only used as fallbacks.
+    """
+    enabled = [PROVIDERS[name] for name in GENERATION_PROVIDERS if name in PROVIDERS]
+    capable = [p for p in enabled if mode in p.modes]
+    affordable = [p for p in capable if p.cost_usd <= cost_budget_usd] or capable
+
+    def key(item: tuple[int, Provider]) -> tuple[bool, bool, int]:
+        index, provider = item
+        latency = provider.expected_latency()
+        too_slow = latency is not None and latency > latency_budget_s
+        return (not provider.healthy(), too_slow, index)
+
+    return [p for _, p in sorted(enumerate(affordable), key=key)]
+
+
+async def run_generation(
+    user_photo: PhotoArtifacts,
+    outfit_description: str,
+    outfit_image_url: str,
+    previous_result_url: str | None = None,
+    new_item_image_url: str | None = None,
+    on_stage: StageCallback | None = None,
+) -> str:
+    """Generate with the best provider for this request, falling back to the next on failure."""
+    mode = generation_mode(previous_result_url, new_item_image_url)
+    candidates = route(mode)
+    if not candidates:
+        raise RuntimeError(f"No generation provider enabled for {mode} requests")
+    if len(candidates) > 1 and degraded.use("cheap_provider"):
+        # Cheapest healthy provider first; unhealthy ones stay fallbacks
+        candidates.sort(key=lambda p: (not p.healthy(), p.cost_usd))
+
+    errors: list[str] = []
+    for provider in candidates:
+        try:
+            async with metrics.timed(f"provider.{provider.name}"):
+                return await provider.generate(
+                    user_photo=user_photo,
+                    outfit_description=outfit_description,
+                    outfit_image_url=outfit_image_url,
+                    previous_result_url=previous_result_url,
+                    new_item_image_url=new_item_image_url,
+                    on_stage=on_stage,
+                )
+        except RuntimeError as e:
+            if len(candidates) == 1:
+                raise
+            errors.append(f"{provider.name}: {e}")
+
+    raise RuntimeError("All generation providers failed: " + "; ".join(errors))
@@ -0,0 +1,27 @@
+"""Shared background-removal service, so N API workers don't each hold a u2net copy.
+
+Run it once (backend/serve.py does this) and point the API workers at it with
+REMBG_SERVICE_URL. Its own --workers count is the size of the rembg pool.
+"""
+
+import asyncio
+
+from fastapi import FastAPI, Request, Response
+
+from backend.background import remove_background
+from backend.models import HealthResponse
+
+app = FastAPI(title="FitVision rembg")
+
+
+@app.get("/health", response_model=HealthResponse)
+async def health() -> HealthResponse:
+    return HealthResponse(status="ok")
+
+
+@app.post("/remove")
+async def remove(request: Request) -> Response:
+    """Body: encoded image bytes. Returns the cut-out subject as PNG."""
+    data = await request.body()
+    png = await asyncio.to_thread(remove_background, data)
+    return Response(content=png, media_type="image/png")
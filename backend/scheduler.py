@@ -0,0 +1,204 @@
+"""Priority scheduling with per-user fair queuing in front of Gemini, Replicate and rembg.
+
+Each stage is a Resource with a concurrency limit. Work is tagged with a
+priority class and a user (the client address) via assign(), usually at the
+endpoint:
+
+    interactive  chat turns of a user mid-conversation
+    tryon        first-time /try-on requests
+    background   precomputation and anything not tied to a waiting user
+
+Classes are served in strict priority order. Each Resource keeps one slot
+that only interactive work may take, and a second that background work may
+not take either, so a chat turn finds a free slot unless other chat turns
+hold the reserved one and the rest are busy; then it is first in line for
+the next slot to free up. A user may hold at most SCHEDULER_TRYON_PER_USER
+slots of a Resource for try-ons, so one user's batch can't fill the shared
+slots. Within a class, users are served by start-time fair queuing: a user
+with many queued requests gets one turn per round, not the whole queue.
+
+Blocking stages (Gemini's SDK call, local rembg) run on the Resource's own
+thread pool rather than the default one, so they can't starve short
+to_thread work like image preparation. Queue wait per Resource and class is
+recorded as the metrics stage "queue.<resource>.<class>".
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import itertools
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from starlette.requests import HTTPConnection
+
+from backend import metrics
+from backend.config import (
+    SCHEDULER_GEMINI_CONCURRENCY, SCHEDULER_REMBG_CONCURRENCY, SCHEDULER_REPLICATE_CONCURRENCY,
+    SCHEDULER_TRYON_PER_USER,
+)
+
+PRIORITIES = {"interactive": 0, "tryon": 1, "background": 2}
+
+# Slots each class must leave free for higher classes (capped so every class can run)
+RESERVED = {"interactive": 0, "tryon": 1, "background": 2}
+
+# Most slots of one Resource a single user may hold per class
+PER_USER = {"tryon": SCHEDULER_TRYON_PER_USER}
+
+# Idle users' fairness tags are forgotten once a Resource tracks this many
+MAX_TRACKED_USERS = 1024
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    start: float
+    seq: int
+    job_class: str = field(compare=False)
+    user: str = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class Resource:
+    def __init__(self, name: str, limit: int, threaded: bool = False) -> None:
+        self.name = name
+        self.limit = max(1, limit)
+        self.active: Counter[str] = Counter()
+        self._active_users: Counter[tuple[str, str]] = Counter()
+        self.executor = ThreadPoolExecutor(self.limit, thread_name_prefix=name) if threaded else None
+        self._waiting: list[_Waiter] = []
+        self._virtual_time = 0.0
+        # (class, user) -> start tag of that user's next request
+        self._next_start: dict[tuple[str, str], float] = {}
+        self._seq = itertools.count()
+
+    def _has_room(self, job_class: str, user: str) -> bool:
+        cap = PER_USER.get(job_class)
+        if cap is not None and self._active_users[job_class, user] >= cap:
+            return False
+        busy = sum(self.active.values())
+        return busy < self.limit - min(RESERVED[job_class], self.limit - 1)
+
+    def _tag(self, job_class: str, user: str) -> float:
+        """Start tag for a new request: the later of now (virtual) and the user's previous finish."""
+        flow = (job_class, user)
+        start = max(self._virtual_time, self._next_start.get(flow, 0.0))
+        self._next_start[flow] = start + 1.0
+        if len(self._next_start) > MAX_TRACKED_USERS:
+            self._next_start = {f: t for f, t in self._next_start.items() if t > self._virtual_time}
+        return start
+
+    def _grant(self, job_class: str, user: str, start: float) -> None:
+        self.active[job_class] += 1
+        self._active_users[job_class, user] += 1
+        self._virtual_time = max(self._virtual_time, start)
+
+    def _dispatch(self) -> None:
+        """Grant slots to waiters in (priority, start tag) order, skipping users at their cap."""
+        waiting = sorted(w for w in self._waiting if not w.future.cancelled())
+        self._waiting = []
+        for waiter in waiting:
+            if self._has_room(waiter.job_class, waiter.user):
+                self._grant(waiter.job_class, waiter.user, waiter.start)
+                waiter.future.set_result(None)
+            else:
+                self._waiting.append(waiter)
+
+    async def acquire(self, job_class: str, user: str) -> None:
+        start = self._tag(job_class, user)
+        if not self._waiting and self._has_room(job_class, user):
+            self._grant(job_class, user, start)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append(_Waiter(PRIORITIES[job_class], start, next(self._seq), job_class, user, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(job_class, user)  # granted just as we were cancelled
+            raise
+
+    def release(self, job_class: str, user: str) -> None:
+        self.active[job_class] -= 1
+        self._active_users[job_class, user] -= 1
+        if self._active_users[job_class, user] <= 0:
+            del self._active_users[job_class, user]
+        self._dispatch()
+
+    def snapshot(self) -> dict:
+        waiting = Counter(w.job_class for w in self._waiting if not w.future.cancelled())
+        return {"limit": self.limit, "active": dict(+self.active), "waiting": dict(waiting)}
+
+
+RESOURCES = {
+    "gemini": Resource("gemini", SCHEDULER_GEMINI_CONCURRENCY, threaded=True),
+    "replicate": Resource("replicate", SCHEDULER_REPLICATE_CONCURRENCY),
+    "rembg": Resource("rembg", SCHEDULER_REMBG_CONCURRENCY, threaded=True),
+}
+
+# (class, user) of the work running in this context
+_job: ContextVar[tuple[str, str]] = ContextVar("job", default=("background", "system"))
+
+
+def assign(job_class: str, user: str) -> None:
+    """Tag the current request (and the tasks it spawns) with a priority class and user."""
+    if job_class not in PRIORITIES:
+        raise ValueError(f"Unknown job class {job_class!r}. Must be one of {list(PRIORITIES)}")
+    _job.set((job_class, user))
+
+
+def client_key(conn: HTTPConnection) -> str:
+    """The user key for a request or WebSocket: the client address."""
+    return conn.client.host if conn.client else "unknown"
+
+
+@asynccontextmanager
+async def slot(resource: str):
+    """Hold one of a Resource's slots, queued by the current job's class and user."""
+    res = RESOURCES[resource]
+    job_class, user = _job.get()
+    async with metrics.timed(f"queue.{resource}.{job_class}"):
+        await res.acquire(job_class, user)
+    try:
+        yield
+    finally:
+        res.release(job_class, user)
+
+
+async def run(resource: str, stage: str | None, fn, /, *args, **kwargs):
+    """
+    Run a blocking call on a Resource's thread pool while holding one of its slots.
+
+    `stage` names the metrics stage timing the call itself (queue wait excluded).
+    If the caller is cancelled the slot is held until the thread finishes, so
+    the limit always matches the threads really in use.
+    """
+    res = RESOURCES[resource]
+    job_class, user = _job.get()
+    async with metrics.timed(f"queue.{resource}.{job_class}"):
+        await res.acquire(job_class, user)
+
+    call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+    try:
+        pending = asyncio.get_running_loop().run_in_executor(res.executor, call)
+        async with metrics.timed(stage) if stage else contextlib.nullcontext():
+            result = await asyncio.shield(pending)
+    except asyncio.CancelledError:
+        pending.add_done_callback(lambda _: res.release(job_class, user))
+        raise
+    except BaseException:
+        res.release(job_class, user)
+        raise
+    res.release(job_class, user)
+    return result
+
+
+def snapshot() -> dict[str, dict]:
+    return {name: res.snapshot() for name, res in RESOURCES.items()}
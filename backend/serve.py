@@ -0,0 +1,93 @@
+"""Multi-process launcher: N API workers sharing one session store, data dir and rembg pool.
+
+    python -m backend.serve --workers 4 --rembg-workers 1
+
+Starts the shared rembg service (backend/rembg_service.py) and uvicorn with
+--workers N for backend.main:app, wired together through environment
+variables: SESSION_STORE=sqlite, a common PHOTOS_DIR / RESULTS_DIR /
+SESSION_DB_PATH under --data-dir, and REMBG_SERVICE_URL. With TRACE_PATH
+set and no TRACE_HASH_KEY, one key is generated for all workers so their
+traces hash inputs the same way.
+
+Session state lives in the shared store, so requests need no sticky routing:
+any worker can serve any session, and a WebSocket session channel stays on
+the worker that accepted it for its whole lifetime.
+"""
+
+import argparse
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+def _uvicorn(app: str, host: str, port: int, workers: int, env: dict[str, str]) -> subprocess.Popen:
+    cmd = [
+        sys.executable, "-m", "uvicorn", app,
+        "--host", host, "--port", str(port), "--workers", str(workers),
+    ]
+    return subprocess.Popen(cmd, env=env)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--data-dir", default=".", help="Shared dir for photos/, results/ and sessions.db")
+    parser.add_argument("--rembg-workers", type=int, default=1, help="Size of the shared rembg pool")
+    parser.add_argument("--rembg-port", type=int, default=8001)
+    parser.add_argument("--rembg-url", default="", help="Use an already running rembg service instead")
+    parser.add_argument("--app", default="backend.main:app", help="ASGI app for the API workers")
+    args = parser.parse_args(argv)
+
+    data_dir = Path(args.data_dir)
+    for sub in ("photos", "results"):
+        (data_dir / sub).mkdir(parents=True, exist_ok=True)
+
+    shared_env = {
+        **os.environ,
+        "PHOTOS_DIR": str(data_dir / "photos"),
+        "RESULTS_DIR": str(data_dir / "results"),
+    }
+
+    procs: list[subprocess.Popen] = []
+    rembg_url = args.rembg_url
+    if not rembg_url:
+        rembg_env = {k: v for k, v in shared_env.items() if k != "REMBG_SERVICE_URL"}
+        procs.append(_uvicorn("backend.rembg_service:app", args.host, args.rembg_port, args.rembg_workers, rembg_env))
+        rembg_url = f"http://{args.host}:{args.rembg_port}"
+
+    api_env = {
+        **shared_env,
+        "SESSION_STORE": "sqlite",
+        "SESSION_DB_PATH": str(data_dir / "sessions.db"),
+        "REMBG_SERVICE_URL": rembg_url,
+    }
+    if api_env.get("TRACE_PATH") and not api_env.get("TRACE_HASH_KEY"):
+        api_env["TRACE_HASH_KEY"] = secrets.token_hex(32)
+    procs.append(_uvicorn(args.app, args.host, args.port, args.workers, api_env))
+    print(f"FitVision: {args.workers} API worker(s) on :{args.port}, rembg at {rembg_url}")
+
+    # Treat SIGTERM like Ctrl-C so the workers are always torn down with us
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        # Exit (and take the rest down) as soon as any process dies
+        while all(p.poll() is None for p in procs):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs:
+            if p.poll() is None:
+                p.terminate()
+        for p in procs:
+            p.wait()
+    return max((p.returncode or 0) for p in procs)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Session persistence: an in-process dict, or a SQLite file shared by every API worker.
+
+Records are plain JSON-able dicts (see pipeline._to_record). Each session also
+has a generation counter: a chat turn claims a new generation when it starts
+and may only commit if nobody has claimed a newer one since, which keeps
+superseded turns from overwriting state even when they ran on another worker.
+
+Both stores have the same async interface; the SQLite one runs its queries
+on a worker thread so they never block the event loop.
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+from backend.config import SESSION_DB_PATH, SESSION_STORE
+
+
+class MemorySessionStore:
+    def __init__(self) -> None:
+        # session_id -> [record, generation, last_active]
+        self._rows: dict[str, list] = {}
+
+    async def create(self, session_id: str, record: dict) -> None:
+        self._rows[session_id] = [record, 0, time.time()]
+
+    async def get(self, session_id: str) -> dict | None:
+        """Return the record and mark the session active."""
+        row = self._rows.get(session_id)
+        if row is None:
+            return None
+        row[2] = time.time()
+        return row[0]
+
+    async def claim(self, session_id: str) -> int | None:
+        """Start a new generation for the session; returns it (None if the session is gone)."""
+        row = self._rows.get(session_id)
+        if row is None:
+            return None
+        row[1] += 1
+        return row[1]
+
+    async def commit(self, session_id: str, record: dict, generation: int) -> bool:
+        """Store the record only if `generation` is still the latest claim."""
+        row = self._rows.get(session_id)
+        if row is None or row[1] != generation:
+            return False
+        row[0], row[2] = record, time.time()
+        return True
+
+    async def expire(self, ttl_seconds: float) -> list[str]:
+        """Delete sessions idle for longer than ttl_seconds; returns their ids."""
+        cutoff = time.time() - ttl_seconds
+        expired = [sid for sid, row in self._rows.items() if row[2] < cutoff]
+        for sid in expired:
+            del self._rows[sid]
+        return expired
+
+
+class SqliteSessionStore:
+    def __init__(self, path: str) -> None:
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " id TEXT PRIMARY KEY, record TEXT NOT NULL,"
+                " generation INTEGER NOT NULL DEFAULT 0, last_active REAL NOT NULL)"
+            )
+
+    def _execute_blocking(self, sql: str, params: tuple) -> tuple[list, int]:
+        with self._lock:
+            cur = self._conn.execute(sql, params)
+            return cur.fetchall(), cur.rowcount
+
+    async def _execute(self, sql: str, params: tuple = ()) -> tuple[list, int]:
+        """Run one statement to completion (so it commits) off-loop; returns (rows, rowcount)."""
+        return await asyncio.to_thread(self._execute_blocking, sql, params)
+
+    async def create(self, session_id: str, record: dict) -> None:
+        await self._execute(
+            "INSERT INTO sessions (id, record, generation, last_active) VALUES (?, ?, 0, ?)",
+            (session_id, json.dumps(record), time.time()),
+        )
+
+    async def get(self, session_id: str) -> dict | None:
+        rows, _ = await self._execute(
+            "UPDATE sessions SET last_active = ? WHERE id = ? RETURNING record",
+            (time.time(), session_id),
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    async def claim(self, session_id: str) -> int | None:
+        rows, _ = await self._execute(
+            "UPDATE sessions SET generation = generation + 1 WHERE id = ? RETURNING generation",
+            (session_id,),
+        )
+        return rows[0][0] if rows else None
+
+    async def commit(self, session_id: str, record: dict, generation: int) -> bool:
+        _, rowcount = await self._execute(
+            "UPDATE sessions SET record = ?, last_active = ? WHERE id = ? AND generation = ?",
+            (json.dumps(record), time.time(), session_id, generation),
+        )
+        return rowcount == 1
+
+    async def expire(self, ttl_seconds: float) -> list[str]:
+        rows, _ = await self._execute(
+            "DELETE FROM sessions WHERE last_active < ? RETURNING id",
+            (time.time() - ttl_seconds,),
+        )
+        return [r[0] for r in rows]
+
+
+def open_store() -> MemorySessionStore | SqliteSessionStore:
+    """Build the store selected by SESSION_STORE ("memory" or "sqlite")."""
+    if SESSION_STORE == "sqlite":
+        return SqliteSessionStore(SESSION_DB_PATH)
+    if SESSION_STORE != "memory":
+        raise ValueError(f"Invalid SESSION_STORE: {SESSION_STORE}. Must be 'memory' or 'sqlite'")
+    return MemorySessionStore()
@@ -2,32 +2,64 @@ import os
 import uuid
 from pathlib import Path
 
-from fastapi import UploadFile
+import anyio
 
 from backend.config import BASE_URL, PHOTOS_DIR, VALID_PHOTO_TYPES
 
 
+def _tmp_path(path: Path) -> Path:
+    return path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+
+
+def atomic_write(path: Path, data: bytes) -> None:
+    """Write via a temp file + rename so readers (and other workers) never see a partial file."""
+    tmp = _tmp_path(path)
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+async def atomic_write_async(path: Path, data: bytes) -> None:
+    """atomic_write with non-blocking file I/O, for use on the event loop."""
+    tmp = anyio.Path(_tmp_path(path))
+    await tmp.write_bytes(data)
+    await tmp.replace(path)
+
+
 def ensure_photos_dir() -> None:
     Path(PHOTOS_DIR).mkdir(exist_ok=True)
 
 
-async def save_photo(file: UploadFile, photo_type: str) -> str:
+def new_photo_name(photo_type: str, upload_name: str | None) -> str:
+    """A fresh filename for an uploaded photo of this type."""
     if photo_type not in VALID_PHOTO_TYPES:
         raise ValueError(f"Invalid photo_type: {photo_type}. Must be one of {VALID_PHOTO_TYPES}")
+    ext = Path(upload_name).suffix if upload_name else ".jpg"
+    return f"{photo_type}_{uuid.uuid4().hex[:8]}{ext}"
+
 
+def photo_url(filename: str) -> str:
+    return f"{BASE_URL}/photos/{filename}"
+
+
+def save_photo(photo_type: str, filename: str, content: bytes) -> str:
+    """Store a photo named by new_photo_name, replacing the previous one of its type. Returns its URL."""
     ensure_photos_dir()
+    filepath = Path(PHOTOS_DIR) / filename
+    atomic_write(filepath, content)
 
-    # Remove any existing photo of this type
+    # Remove any older photo of this type (another worker may be doing the same)
     for existing in Path(PHOTOS_DIR).glob(f"{photo_type}_*"):
-        existing.unlink()
+        if existing != filepath:
+            existing.unlink(missing_ok=True)
 
-    ext = Path(file.filename).suffix if file.filename else ".jpg"
-    filename = f"{photo_type}_{uuid.uuid4().hex[:8]}{ext}"
-    filepath = Path(PHOTOS_DIR) / filename
+    return photo_url(filename)
 
-    content = await file.read()
-    filepath.write_bytes(content)
 
+def save_outfit(content: bytes, ext: str = ".jpg") -> str:
+    """Store an uploaded outfit/garment image, returns its URL."""
+    ensure_photos_dir()
+    filename = f"outfit_{uuid.uuid4().hex[:8]}{ext}"
+    atomic_write(Path(PHOTOS_DIR) / filename, content)
     return f"{BASE_URL}/photos/{filename}"
 
 
@@ -0,0 +1,152 @@
+"""Request traces: sanitized records of try-on and chat calls for offline replay.
+
+With TRACE_PATH set, every /try-on, /chat and WebSocket chat turn appends
+one JSON line: endpoint, wall-clock start, total duration, outcome, the
+degraded-mode shortcuts taken, and the timing of each metrics stage
+(Gemini calls, providers, rembg) as offsets from the request start.
+
+Request fields are sanitized: strings (URLs, messages, session IDs, inline
+image data) are replaced by a short HMAC-SHA256 keyed with TRACE_HASH_KEY,
+so traces carry no user content and can't be reversed by hashing guesses
+without the key, but repeated inputs and sessions can still be matched up.
+Lines are written by a background thread, off the event loop.
+tests/replay.py replays a trace file against the pipeline with stubbed
+providers.
+"""
+
+import atexit
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+
+from pydantic import BaseModel
+
+from backend.config import TRACE_HASH_KEY, TRACE_PATH
+
+# Request fields recorded verbatim: small enums that steer the pipeline
+PLAIN_FIELDS = {"type", "result_format"}
+
+
+@dataclass
+class Trace:
+    endpoint: str
+    started_at: float  # time.time()
+    inputs: dict[str, object]
+    outputs: dict[str, object] = field(default_factory=dict)
+    stages: list[dict] = field(default_factory=list)
+    duration_s: float = 0.0
+    status: str = ""
+    degraded: list[str] = field(default_factory=list)
+    _start: float = field(default_factory=time.perf_counter, repr=False)
+
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar[Trace | None] = ContextVar("trace", default=None)
+_hash_key = TRACE_HASH_KEY.encode() or os.urandom(32)
+if TRACE_PATH and not TRACE_HASH_KEY:
+    logger.warning(
+        "TRACE_PATH is set without TRACE_HASH_KEY: using a random per-process key, "
+        "so traces from different workers can't be matched up"
+    )
+
+# Lines waiting for the writer thread; None tells it to stop
+_lines: queue.SimpleQueue[str | None] = queue.SimpleQueue()
+_writer: threading.Thread | None = None
+_writer_lock = threading.Lock()
+
+
+def hash_value(value: str) -> str:
+    return hmac.new(_hash_key, value.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def sanitize(fields: dict) -> dict[str, object]:
+    """Hash strings (except PLAIN_FIELDS); keep numbers, booleans and None."""
+    return {
+        name: hash_value(value) if isinstance(value, str) and name not in PLAIN_FIELDS else value
+        for name, value in fields.items()
+    }
+
+
+def record_stage(name: str, start: float, seconds: float, ok: bool) -> None:
+    """Add a finished stage (perf_counter start) to the current request's trace, if any."""
+    trace = _current.get()
+    if trace is not None:
+        trace.stages.append({
+            "stage": name,
+            "start_s": round(start - trace._start, 4),
+            "seconds": round(seconds, 4),
+            "ok": ok,
+        })
+
+
+def _write_lines() -> None:
+    """Writer thread: append queued lines until told to stop."""
+    fd = os.open(TRACE_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        while (line := _lines.get()) is not None:
+            # One write per line on an O_APPEND file, so workers sharing TRACE_PATH don't interleave
+            os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+
+def _stop_writer() -> None:
+    if _writer is not None:
+        _lines.put(None)
+        _writer.join(timeout=5)
+
+
+def _append(trace: Trace) -> None:
+    """Queue a finished trace for the writer thread (started on first use)."""
+    global _writer
+    record = {k: v for k, v in asdict(trace).items() if not k.startswith("_")}
+    _lines.put(json.dumps(record) + "\n")
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_lines, name="trace-writer", daemon=True)
+            _writer.start()
+            atexit.register(_stop_writer)
+
+
+@asynccontextmanager
+async def capture(endpoint: str, request: BaseModel):
+    """Trace the enclosed request handling; the caller fills in status/outputs on the yielded Trace."""
+    trace = Trace(endpoint=endpoint, started_at=time.time(), inputs=sanitize(request.model_dump()))
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        trace.status = trace.status or "exception"
+        trace.duration_s = round(time.perf_counter() - trace._start, 4)
+        if TRACE_PATH:
+            _append(trace)
+
+
+def traced(endpoint: str):
+    """Decorator for endpoints taking a request model first and returning a response with status/session_id."""
+
+    def decorate(handler):
+        @functools.wraps(handler)
+        async def run(request: BaseModel, *args, **kwargs):
+            async with capture(endpoint, request) as trace:
+                response = await handler(request, *args, **kwargs)
+                trace.status = response.status
+                trace.degraded = list(response.degraded)
+                if response.session_id:
+                    trace.outputs["session_id"] = hash_value(response.session_id)
+                return response
+
+        return run
+
+    return decorate
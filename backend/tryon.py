@@ -1,33 +1,22 @@
+import asyncio
 import io
-from pathlib import Path
 
 import replicate
-from PIL import Image
 
-from backend.config import REPLICATE_API_TOKEN
+from backend import degraded, imaging
+from backend.config import DEGRADED_INPUT_MAX_DIMENSION
+from backend.flux_tryon import load_raw, run_prediction
 
 IDMVTON_MODEL = "cuuupid/idm-vton:0513734a452173b8173e907e3a59d19a36266e55b48528559432bd21c7d7e985"
 
 MAX_DIMENSION = 1920
 
 
-def _prepare_local_image(path: Path) -> io.BytesIO:
-    """Load a local image, convert to RGB, resize if needed, return as JPEG bytes."""
-    img = Image.open(path).convert("RGB")
-    if max(img.size) > MAX_DIMENSION:
-        img.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.LANCZOS)
-    buf = io.BytesIO()
-    img.save(buf, format="JPEG", quality=90)
-    buf.seek(0)
-    return buf
-
-
-def _to_file_input(path_or_url: str) -> str | io.BytesIO:
-    """If it's a local file path, preprocess and return as bytes. Otherwise return the URL."""
-    p = Path(path_or_url)
-    if p.exists() and p.is_file():
-        return _prepare_local_image(p)
-    return path_or_url
+async def _to_file_input(path_or_url: str, max_dimension: int = MAX_DIMENSION) -> io.BytesIO:
+    """Load a local path, backend URL or remote URL and return it as a resized JPEG."""
+    raw = await load_raw(path_or_url)
+    prepared = await asyncio.to_thread(imaging.prepare, raw, max_dimension, quality=90)
+    return prepared.buf
 
 
 async def run_tryon(
@@ -35,26 +24,37 @@ async def run_tryon(
     garm_img_url: str,
     category: str,
     garment_des: str = "Garment",
+    human_img: io.BytesIO | str | None = None,
 ) -> str:
+    """
+    Run IDM-VTON on Replicate. Returns the raw output image URL.
+
+    human_img is an already prepared input for the person (e.g. from
+    photo_artifacts); when given, human_img_url isn't loaded again. In
+    degraded mode (lower_quality) the inputs prepared here are smaller.
+    """
+    max_dimension = DEGRADED_INPUT_MAX_DIMENSION if degraded.use("lower_quality") else MAX_DIMENSION
     try:
-        client = replicate.Client(api_token=REPLICATE_API_TOKEN)
+        if human_img is None:
+            human_img, garm_img = await asyncio.gather(
+                _to_file_input(human_img_url, max_dimension),
+                _to_file_input(garm_img_url, max_dimension),
+            )
+        else:
+            garm_img = await _to_file_input(garm_img_url, max_dimension)
 
-        output = client.run(
+        # IDM-VTON returns a single image URL
+        return await run_prediction(
             IDMVTON_MODEL,
-            input={
-                "human_img": _to_file_input(human_img_url),
-                "garm_img": _to_file_input(garm_img_url),
+            {
+                "human_img": human_img,
+                "garm_img": garm_img,
                 "category": category,
                 "garment_des": garment_des,
                 "crop": True,
             },
         )
 
-        # IDM-VTON returns a single image URL
-        if isinstance(output, list):
-            return str(output[0])
-        return str(output)
-
     except replicate.exceptions.ReplicateError as e:
         raise RuntimeError(f"Replicate API error: {e}") from e
     except Exception as e:
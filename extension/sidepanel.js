@@ -1,6 +1,9 @@
 const BACKEND_URL = "http://localhost:8000";
 const STORAGE_USER_PHOTO = "fitted_user_photo";
 const STORAGE_GARMENTS = "fitted_garments";
+// Ask the backend to return the result inline as WebP (with alpha), saving
+// the follow-up PNG download
+const RESULT_OPTIONS = { result_format: "webp", inline: true };
 
 const stageImg = document.getElementById("stage-img");
 const uploadOverlay = document.getElementById("upload-overlay");
@@ -17,6 +20,13 @@ const garmentsRow = document.getElementById("garments-row");
 let basePhotoUrl = "";
 let sessionId = null;
 let lastTriedUrl = null;
+let sessionSocket = null;
+
+const STAGE_LABELS = {
+  describing: "Updating description...",
+  generating: "Generating try-on...",
+  removing_background: "Removing background...",
+};
 
 // --- Helpers ---
 
@@ -165,15 +175,16 @@ async function tryOnGarment(url) {
     const resp = await fetch(`${BACKEND_URL}/try-on`, {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ image_url: url }),
+      body: JSON.stringify({ image_url: url, ...RESULT_OPTIONS }),
     });
     const data = await resp.json();
 
     if (data.status === "success" && data.tryon_image_url) {
-      setStageImage(data.tryon_image_url);
+      setStageImage(data.tryon_image_data || data.tryon_image_url);
       sessionId = data.session_id;
       lastTriedUrl = url;
-      setStatus(data.description || "Done. Type a message to modify.");
+      openSessionSocket(sessionId);
+      setStatus(resultStatus(data, "Done. Type a message to modify."));
     } else {
       throw new Error(data.error || "Try-on failed");
     }
@@ -184,6 +195,48 @@ async function tryOnGarment(url) {
   }
 }
 
+// Status line for a result; notes when the backend took degraded-mode shortcuts
+function resultStatus(data, fallback) {
+  const text = data.description || fallback;
+  return data.degraded?.length ? `${text} (busy: reduced quality)` : text;
+}
+
+// --- Session channel ---
+
+function openSessionSocket(id) {
+  closeSessionSocket();
+  const socket = new WebSocket(`${BACKEND_URL.replace(/^http/, "ws")}/ws/sessions/${id}`);
+
+  socket.addEventListener("message", (event) => {
+    const data = JSON.parse(event.data);
+    if (data.type === "progress") {
+      showSpinner(true, STAGE_LABELS[data.stage] || "Modifying outfit...");
+    } else if (data.type === "result") {
+      setStageImage(data.tryon_image_data || data.tryon_image_url);
+      promptInput.value = "";
+      setStatus(resultStatus(data, "Done."));
+      showSpinner(false);
+    } else if (data.type === "error") {
+      setStatus(data.error || "Modification failed.");
+      showSpinner(false);
+    }
+    // "cancelled" means a newer message superseded the turn — keep the spinner
+  });
+
+  socket.addEventListener("close", () => {
+    if (sessionSocket === socket) sessionSocket = null;
+  });
+
+  sessionSocket = socket;
+}
+
+function closeSessionSocket() {
+  if (sessionSocket) {
+    sessionSocket.close();
+    sessionSocket = null;
+  }
+}
+
 // --- Chat ---
 
 async function sendChat() {
@@ -201,24 +254,33 @@ async function sendChat() {
   showSpinner(true, "Modifying outfit...");
   setStatus("");
 
+  // Prefer the persistent session channel; a newer message cancels the older one
+  if (sessionSocket && sessionSocket.readyState === WebSocket.OPEN) {
+    sessionSocket.send(JSON.stringify({ type: "chat", message: msg, ...RESULT_OPTIONS }));
+    return;
+  }
+
   try {
     const resp = await fetch(`${BACKEND_URL}/chat`, {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ session_id: sessionId, message: msg }),
+      body: JSON.stringify({ session_id: sessionId, message: msg, ...RESULT_OPTIONS }),
     });
     const data = await resp.json();
 
+    // A newer message replaced this one; its own response will update the UI
+    if (data.status === "superseded") return;
+
     if (data.status === "success" && data.tryon_image_url) {
-      setStageImage(data.tryon_image_url);
+      setStageImage(data.tryon_image_data || data.tryon_image_url);
       promptInput.value = "";
-      setStatus(data.description || "Done.");
+      setStatus(resultStatus(data, "Done."));
     } else {
       throw new Error(data.error || "Modification failed");
     }
+    showSpinner(false);
   } catch (err) {
     setStatus(err instanceof Error ? err.message : "Modification failed.");
-  } finally {
     showSpinner(false);
   }
 }
@@ -240,6 +302,7 @@ promptInput.addEventListener("keydown", (e) => {
 });
 
 resetBtn.addEventListener("click", () => {
+  closeSessionSocket();
   sessionId = null;
   lastTriedUrl = null;
   promptInput.value = "";
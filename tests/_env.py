@@ -0,0 +1,23 @@
+"""Test configuration for the backend; import before anything from backend.
+
+backend.config reads the environment once, at import, so tests that import
+the app need these set first: scratch photo/result dirs, a remote rembg URL
+(so the local model isn't downloaded) and a placeholder Gemini key. Nothing
+is sent to Gemini, Replicate or rembg; tests stub the calls they reach.
+"""
+
+import os
+import tempfile
+from pathlib import Path
+
+DATA_DIR = Path(tempfile.mkdtemp(prefix="fitted-tests-"))
+
+os.environ.update({
+    "PHOTOS_DIR": str(DATA_DIR / "photos"),
+    "RESULTS_DIR": str(DATA_DIR / "results"),
+    "REMBG_SERVICE_URL": "http://rembg.invalid",
+    "REPLICATE_UPLOAD_USER_PHOTOS": "false",
+    "SESSION_STORE": "memory",
+    "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY") or "test",
+    "TRACE_PATH": "",
+})
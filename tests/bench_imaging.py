@@ -0,0 +1,89 @@
+"""Microbenchmark: input image decode/resize paths used before every FLUX call.
+
+Compares the original full-decode + LANCZOS thumbnail path against
+backend.imaging (draft-mode JPEG decode, single decode for size + resize) on
+each available resampling backend. Uses synthetic phone-sized photos, so no
+API keys or network are needed.
+
+Run: python -m tests.bench_imaging
+"""
+
+import io
+import statistics
+import time
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from backend import imaging
+
+MAX_DIMENSION = 1024
+ROUNDS = 10
+
+# (label, size, format) — a 12MP phone JPEG, a portrait JPEG and a screenshot PNG
+SAMPLES = [
+    ("12MP JPEG", (4032, 3024), "JPEG"),
+    ("portrait JPEG", (1800, 2400), "JPEG"),
+    ("PNG", (1600, 1200), "PNG"),
+]
+
+
+def make_sample(size: tuple[int, int], fmt: str) -> bytes:
+    """Build a photo-like image (gradient + shapes + blur) and encode it."""
+    w, h = size
+    img = Image.linear_gradient("L").resize(size).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for i in range(0, w, w // 12):
+        draw.ellipse((i, h // 4, i + w // 10, h // 2), fill=(i % 255, 80, 160))
+        draw.rectangle((i, h // 2, i + w // 20, h - 1), fill=(200, i % 255, 40))
+    img = img.filter(ImageFilter.GaussianBlur(2))
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, quality=92)
+    return buf.getvalue()
+
+
+def baseline(data: bytes) -> tuple[io.BytesIO, tuple[int, int]]:
+    """The pre-imaging path: two opens, full decode, convert, thumbnail, encode."""
+    size = Image.open(io.BytesIO(data)).size
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    img.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    buf.seek(0)
+    return buf, size
+
+
+def timeit(fn, data: bytes) -> float:
+    """Median wall time in milliseconds over ROUNDS runs (after one warm-up)."""
+    fn(data)
+    samples = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        fn(data)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    print("=== Image prep microbenchmark ===")
+    print(f"Pillow {imaging.PIL.__version__} (simd={imaging.PILLOW_SIMD}), "
+          f"backends: {imaging.available_backends()}, auto -> {imaging.pick_backend('auto')}")
+    print(f"Target: longest side {MAX_DIMENSION}px, median of {ROUNDS} runs\n")
+
+    cases = [("baseline (full decode)", baseline)]
+    for backend in imaging.available_backends():
+        cases.append((f"prepare [{backend}]", lambda d, b=backend: imaging.prepare(d, MAX_DIMENSION, b)))
+    cases.append(("probe_size (header only)", imaging.probe_size))
+
+    for label, size, fmt in SAMPLES:
+        data = make_sample(size, fmt)
+        print(f"{label} {size[0]}x{size[1]} ({len(data) / 1e6:.1f} MB)")
+        base_ms = None
+        for name, fn in cases:
+            ms = timeit(fn, data)
+            base_ms = base_ms or ms
+            print(f"  {name:<28} {ms:8.2f} ms  ({base_ms / ms:5.1f}x)")
+        print()
+
+
+if __name__ == "__main__":
+    main()
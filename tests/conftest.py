@@ -0,0 +1 @@
+from tests import _env  # noqa: F401  (configures the backend before any test imports it)
@@ -0,0 +1,26 @@
+"""backend.main:app with Gemini, Replicate and rembg stubbed, for the load test's chat scenario.
+
+Each worker installs tests/replay.py's stubs, which sleep for a fixed
+per-stage latency (times LOAD_TEST_LATENCY_SCALE) instead of calling out.
+Everything else (photo artifacts, input preparation, decode and variant
+encoding, sessions in the shared store, scheduling) runs for real.
+
+    python -m backend.serve --app tests.load_app:app ...
+"""
+
+import os
+
+from tests.replay import install_stubs
+
+# Typical production latencies (seconds) of the stubbed stages
+STAGE_LATENCIES = {
+    "gemini.classify": 2.0,
+    "gemini.update": 1.5,
+    "provider.flux": 10.0,
+    "provider.idm-vton": 8.0,
+    "rembg": 1.2,
+}
+
+install_stubs(float(os.environ.get("LOAD_TEST_LATENCY_SCALE", "0.1")), STAGE_LATENCIES)
+
+from backend.main import app  # noqa: E402,F401
@@ -0,0 +1,195 @@
+"""Load test: API throughput vs number of workers under backend.serve.
+
+For each worker count, starts `python -m backend.serve --workers N` on a
+scratch data dir and runs the selected scenarios:
+
+    cheap  hammer endpoints that don't call Gemini/Replicate (GET /user-photos,
+           GET /health) with concurrent clients; prints req/s. Throughput
+           should grow with N up to the number of cores.
+    chat   --clients concurrent users each run a /try-on and then --turns
+           /chat turns on their session, against tests/load_app.py (the app
+           with Gemini, Replicate and rembg stubbed by fixed sleeps scaled by
+           --latency-scale). Sessions live in the shared SQLite store, so
+           turns of one session land on different workers. Prints try-on and
+           chat latency percentiles and completed requests/s.
+
+The API tier is measured on its own: --rembg-url points at an address with
+nothing listening, so no u2net model is loaded. A GEMINI_API_KEY (any value)
+must be set for the app to import.
+
+Run: python -m tests.load_test --workers 1 2 4 --requests 2000 --concurrency 64 --clients 32 --turns 3
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from tests.replay import make_image, percentile
+
+PORT = 8765
+ENDPOINTS = ["/user-photos", "/health"]
+APPS = {"cheap": "backend.main:app", "chat": "tests.load_app:app"}
+
+
+async def wait_ready(base_url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(f"{base_url}/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not come up")
+
+
+async def hammer(base_url: str, total: int, concurrency: int) -> tuple[float, int]:
+    """Fire `total` requests with `concurrency` in flight. Returns (req/s, errors)."""
+    queue: asyncio.Queue[int] = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+    errors = 0
+
+    async def client_loop(client: httpx.AsyncClient) -> None:
+        nonlocal errors
+        while not queue.empty():
+            i = queue.get_nowait()
+            try:
+                resp = await client.get(f"{base_url}{ENDPOINTS[i % len(ENDPOINTS)]}")
+                errors += resp.status_code != 200
+            except httpx.TransportError:
+                errors += 1
+
+    # Fresh connections are spread over workers by the kernel, so use one client per slot
+    clients = [httpx.AsyncClient(timeout=30.0) for _ in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop(c) for c in clients))
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*(c.aclose() for c in clients))
+    return total / elapsed, errors
+
+
+async def converse(base_url: str, clients: int, turns: int) -> dict:
+    """Each client runs a try-on and then `turns` chat turns. Returns latencies, errors and req/s."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0) as client:
+        photo = make_image((3024, 4032), "JPEG")
+        resp = await client.post(
+            "/upload-photo", params={"photo_type": "full_body"},
+            files={"file": ("me.jpg", photo, "image/jpeg")},
+        )
+        resp.raise_for_status()
+        resp = await client.post("/upload-outfit", files={"file": ("outfit.jpg", make_image((1024, 1365), "JPEG"))})
+        outfit_url = resp.json()["image_url"]
+
+    latencies: dict[str, list[float]] = {"/try-on": [], "/chat": []}
+    errors: list[str] = []
+
+    async def post(client: httpx.AsyncClient, path: str, body: dict) -> dict | None:
+        start = time.perf_counter()
+        try:
+            resp = await client.post(path, json=body)
+            data = resp.json()
+        except (httpx.TransportError, ValueError) as e:
+            errors.append(f"{path}: {e!r}")
+            return None
+        if data.get("status") != "success":
+            errors.append(f"{path}: {data.get('error') or resp.status_code}")
+            return None
+        latencies[path].append(time.perf_counter() - start)
+        return data
+
+    async def user(i: int) -> None:
+        # uvicorn trusts X-Forwarded-For from localhost, so each client is its own scheduler user
+        headers = {"X-Forwarded-For": f"10.0.{i // 256}.{i % 256}"}
+        async with httpx.AsyncClient(base_url=base_url, timeout=120.0, headers=headers) as client:
+            data = await post(client, "/try-on", {"image_url": outfit_url})
+            if data is None:
+                return
+            for _ in range(turns):
+                if await post(client, "/chat", {"session_id": data["session_id"], "message": "make it cropped"}) is None:
+                    return
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(clients)))
+    elapsed = time.perf_counter() - start
+    done = sum(len(v) for v in latencies.values())
+    return {"latencies": latencies, "errors": errors, "rps": done / elapsed}
+
+
+async def run(workers: int, scenario: str, args: argparse.Namespace):
+    env = {
+        **os.environ,
+        "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY") or "load-test",
+        "LOAD_TEST_LATENCY_SCALE": str(args.latency_scale),
+    }
+    with tempfile.TemporaryDirectory() as data_dir:
+        proc = subprocess.Popen(
+            [
+                sys.executable, "-m", "backend.serve",
+                "--workers", str(workers), "--port", str(PORT), "--app", APPS[scenario],
+                "--data-dir", data_dir, "--rembg-url", "http://127.0.0.1:9",
+            ],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            base_url = f"http://127.0.0.1:{PORT}"
+            await wait_ready(base_url)
+            if scenario == "chat":
+                return await converse(base_url, args.clients, args.turns)
+            await hammer(base_url, min(200, args.requests), args.concurrency)  # warm-up
+            return await hammer(base_url, args.requests, args.concurrency)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def print_chat(workers: int, result: dict, baseline: float) -> None:
+    parts = []
+    for path, values in result["latencies"].items():
+        p50, p95 = percentile(values, 50), percentile(values, 95)
+        parts.append(f"{path} p50={p50 or 0:.2f}s p95={p95 or 0:.2f}s")
+    print(f"  workers={workers:<3} {result['rps']:6.2f} req/s  ({result['rps'] / baseline:4.2f}x)  "
+          f"{'  '.join(parts)}  errors={len(result['errors'])}")
+    for error in sorted(set(result["errors"]))[:3]:
+        print(f"    {error}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--scenario", nargs="+", choices=list(APPS), default=list(APPS))
+    parser.add_argument("--clients", type=int, default=32, help="chat: concurrent users")
+    parser.add_argument("--turns", type=int, default=3, help="chat: chat turns per user after the try-on")
+    parser.add_argument("--latency-scale", type=float, default=0.1, help="chat: multiply stubbed provider latencies")
+    args = parser.parse_args()
+
+    if "cheap" in args.scenario:
+        print(f"=== Load test (cheap): {args.requests} requests, {args.concurrency} concurrent, "
+              f"{os.cpu_count()} cores ===")
+        baseline = None
+        for workers in args.workers:
+            rps, errors = await run(workers, "cheap", args)
+            baseline = baseline or rps
+            print(f"  workers={workers:<3} {rps:8.1f} req/s  ({rps / baseline:4.2f}x)  errors={errors}")
+
+    if "chat" in args.scenario:
+        print(f"=== Load test (chat): {args.clients} users x (1 try-on + {args.turns} turns), "
+              f"latency scale {args.latency_scale}, {os.cpu_count()} cores ===")
+        baseline = None
+        for workers in args.workers:
+            result = await run(workers, "chat", args)
+            baseline = baseline or result["rps"] or 1.0
+            print_chat(workers, result, baseline)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,419 @@
+"""Replay recorded request traces against the pipeline with stubbed providers.
+
+Record traffic with TRACE_PATH set (see backend/traces.py), then:
+
+    python -m tests.replay traces.jsonl --out before.json
+    # ...refactor pipeline.py / flux_tryon.py...
+    python -m tests.replay traces.jsonl --out after.json --compare before.json
+
+tests/golden_traces.jsonl is a small synthetic trace (try-ons followed by
+chat turns, some superseded) that works without recorded traffic;
+--synthesize regenerates it.
+
+Every external call is a stub that sleeps for the time the trace recorded:
+Gemini (gemini.classify / gemini.update), the Replicate prediction
+(provider.* minus the rembg stage and queue waits nested in it) and rembg.
+The stubs hold the same scheduler slots as the real calls, and each trace is
+replayed as its own user. Everything local runs for real on synthetic
+images: input preparation, streaming decode, variant encoding, delivery,
+sessions, supersession, scheduling and the memory budget.
+So the report measures the backend's own overhead and concurrency behaviour.
+Arrivals keep their recorded spacing divided by --speed (or come at a fixed
+--rate), and stub latencies are multiplied by --latency-scale. WebSocket
+turns are replayed through /chat, which runs the same pipeline.
+
+--compare prints per-endpoint deltas against an earlier report and exits
+with status 1 if p95 latency or throughput regressed by more than --threshold.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+
+GOLDEN_TRACES = Path(__file__).with_name("golden_traces.jsonl")
+
+# Stage -> recorded seconds still to be replayed for the current request
+_recorded: ContextVar[dict[str, deque]] = ContextVar("recorded")
+
+
+# --- Traces ---------------------------------------------------------------
+
+
+def load_traces(path: Path) -> list[dict]:
+    with open(path) as f:
+        traces = [json.loads(line) for line in f if line.strip()]
+    return sorted(traces, key=lambda t: t["started_at"])
+
+
+def stub_latencies(trace: dict) -> dict[str, deque]:
+    """
+    Per-stage (seconds, ok) queues for one trace's stubs.
+
+    Provider stages include post-processing and scheduler queue waits, so the
+    rembg and queue.* time nested in a provider's interval is subtracted to
+    get the remote prediction time.
+    """
+    stages = trace["stages"]
+    queues: dict[str, deque] = defaultdict(deque)
+    for s in stages:
+        seconds = s["seconds"]
+        if s["stage"].startswith("provider."):
+            end = s["start_s"] + s["seconds"]
+            nested = sum(
+                n["seconds"] for n in stages
+                if (n["stage"] == "rembg" or n["stage"].startswith("queue."))
+                and s["start_s"] <= n["start_s"] < end
+            )
+            seconds = max(0.0, seconds - nested)
+        queues[s["stage"]].append((seconds, s["ok"]))
+    return queues
+
+
+def synthesize(path: Path, sessions: int = 12, seed: int = 7) -> None:
+    """Write a synthetic trace file: per session a try-on and a few chat turns."""
+    rng = random.Random(seed)
+    traces = []
+    t = 1_700_000_000.0
+    for n in range(sessions):
+        sid = f"{n:016x}"
+        start = t + n * 4.0
+        classify, flux, rembg = rng.uniform(1.5, 3), rng.uniform(8, 12), rng.uniform(0.8, 1.6)
+        traces.append({
+            "endpoint": "/try-on", "started_at": start,
+            "inputs": {"image_url": f"outfit{n % 5:011x}", "result_format": "webp",
+                       "result_max_size": None, "inline": True},
+            "outputs": {"session_id": sid},
+            "stages": [
+                {"stage": "gemini.classify", "start_s": 0.05, "seconds": classify, "ok": True},
+                {"stage": "provider.flux", "start_s": classify + 0.1, "seconds": flux + rembg, "ok": True},
+                {"stage": "rembg", "start_s": classify + flux, "seconds": rembg, "ok": True},
+            ],
+            "duration_s": classify + flux + rembg + 0.3, "status": "success", "degraded": [],
+        })
+        turn_at = start + classify + flux + rembg + rng.uniform(5, 15)
+        for turn in range(3):
+            update, flux, rembg = rng.uniform(1, 2), rng.uniform(8, 12), rng.uniform(0.8, 1.6)
+            layering = turn == 1
+            # Every fourth session fires its last message while the previous turn runs
+            superseding = turn == 2 and n % 4 == 0
+            at = turn_at - 4.0 if superseding else turn_at
+            traces.append({
+                "endpoint": "ws:chat", "started_at": at,
+                "inputs": {"type": "chat", "message": f"msg{n:04x}{turn:09x}",
+                           "image_url": f"item{n:012x}" if layering else None, "image_data": None,
+                           "result_format": "webp", "result_max_size": None, "inline": True,
+                           "session_id": sid},
+                "outputs": {},
+                "stages": [
+                    {"stage": "gemini.update", "start_s": 0.02, "seconds": update, "ok": True},
+                    {"stage": "provider.flux", "start_s": update + 0.05, "seconds": flux + rembg, "ok": True},
+                    {"stage": "rembg", "start_s": update + flux, "seconds": rembg, "ok": True},
+                ],
+                "duration_s": update + flux + rembg + 0.2, "status": "success", "degraded": [],
+            })
+            turn_at = at + update + flux + rembg + rng.uniform(5, 20)
+    with open(path, "w") as f:
+        for trace in sorted(traces, key=lambda t: t["started_at"]):
+            f.write(json.dumps(trace) + "\n")
+    print(f"Wrote {len(traces)} traces to {path}")
+
+
+# --- Synthetic inputs -----------------------------------------------------
+
+
+def make_image(size: tuple[int, int], fmt: str) -> bytes:
+    """A photo-like image (gradient, shapes, noise) so encoders do realistic work."""
+    w, h = size
+    img = Image.linear_gradient("L").resize(size).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for i in range(0, w, w // 10):
+        draw.ellipse((i, h // 4, i + w // 8, h // 2), fill=(i % 255, 90, 150))
+        draw.rectangle((i, h // 2, i + w // 16, h - 1), fill=(190, i % 255, 60))
+    noise = Image.effect_noise(size, 24).convert("RGB")
+    img = Image.blend(img, noise, 0.15).filter(ImageFilter.GaussianBlur(1))
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, quality=90)
+    return buf.getvalue()
+
+
+class Inputs:
+    """Maps hashed trace inputs to synthetic local files (same hash, same file)."""
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self._outfit = make_image((1024, 1365), "JPEG")
+        self._paths: dict[str, str] = {}
+
+    def image(self, key: str | None) -> str | None:
+        if key is None:
+            return None
+        if key not in self._paths:
+            path = self.root / f"outfit_{key}.jpg"
+            path.write_bytes(self._outfit)
+            self._paths[key] = str(path)
+        return self._paths[key]
+
+
+# --- Stubs ----------------------------------------------------------------
+
+
+def install_stubs(latency_scale: float, fallbacks: dict[str, float]) -> None:
+    """Replace Gemini, Replicate and rembg with stubs that replay recorded latencies."""
+    from backend import background, classifier, flux_tryon, imaging, metrics, scheduler, tryon
+    from backend.models import ClassificationResult
+
+    generated = make_image((1024, 1365), "WEBP")
+
+    async def replay_stage(stage: str) -> None:
+        queue = _recorded.get({}).get(stage)
+        seconds, ok = queue.popleft() if queue else (fallbacks.get(stage, 0.0), True)
+        await asyncio.sleep(seconds * latency_scale)
+        if not ok:
+            raise RuntimeError(f"{stage} failed (replayed)")
+
+    async def download_part(image_url: str) -> None:
+        return None
+
+    async def generate(call: str, contents: list) -> ClassificationResult:
+        async with scheduler.slot("gemini"), metrics.timed(f"gemini.{call}"):
+            await replay_stage(f"gemini.{call}")
+        return ClassificationResult(
+            description="black oversized hoodie with light blue straight-leg jeans",
+            fit_notes="relaxed", colors=["black", "light blue"], style="streetwear",
+        )
+
+    async def run_prediction(model: str, model_input: dict) -> str:
+        provider = "provider.flux" if model == flux_tryon.FLUX_MODEL else "provider.idm-vton"
+        async with scheduler.slot("replicate"):
+            await replay_stage(provider)
+        return "replay://output.webp"
+
+    async def stream_decode(url: str, keep_bytes: bool = False):
+        decoder = imaging.StreamDecoder(keep_bytes)
+        for i in range(0, len(generated), 64 * 1024):
+            decoder.feed(generated[i:i + 64 * 1024])
+            await asyncio.sleep(0)
+        return await asyncio.to_thread(decoder.close)
+
+    async def cut_out_async(img: Image.Image, data: bytes | None = None) -> Image.Image:
+        async with scheduler.slot("rembg"), metrics.timed("rembg"):
+            await replay_stage("rembg")
+        return await asyncio.to_thread(img.convert, "RGBA")
+
+    classifier._download_part = download_part
+    classifier._generate = generate
+    flux_tryon.run_prediction = run_prediction
+    tryon.run_prediction = run_prediction
+    flux_tryon._stream_decode = stream_decode
+    background.cut_out_async = cut_out_async
+
+
+# --- Replay ---------------------------------------------------------------
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+async def replay(traces: list[dict], args: argparse.Namespace, data_dir: Path) -> dict:
+    from backend import main, memory, metrics
+    from backend.models import ChatRequest, TryOnRequest
+    from starlette.requests import Request
+
+    inputs = Inputs(data_dir)
+    sessions: dict[str, asyncio.Future] = {}
+    results: list[dict] = []
+
+    def client(user: str) -> Request:
+        """A request from `user`: the scheduler's fairness key is the client address."""
+        return Request({"type": "http", "client": (user, 0), "headers": []})
+
+    async def session_for(key: str, options: dict) -> str | None:
+        """The replayed session ID for a recorded (hashed) one, starting a session if none was recorded."""
+        if key not in sessions:
+            sessions[key] = asyncio.get_running_loop().create_future()
+            _recorded.set({})
+            response = await main.try_on(
+                TryOnRequest(image_url=inputs.image(f"setup{key}"), **options), client(key),
+            )
+            sessions[key].set_result(response.session_id)
+        return await sessions[key]
+
+    async def run_one(trace: dict, delay: float) -> None:
+        await asyncio.sleep(delay)
+        scheduled = time.perf_counter()
+        recorded = trace["inputs"]
+        options = {k: recorded[k] for k in ("result_format", "result_max_size", "inline") if k in recorded}
+        key = trace["outputs"].get("session_id")
+
+        if trace["endpoint"] == "/try-on":
+            _recorded.set(stub_latencies(trace))
+            start = time.perf_counter()
+            response = await main.try_on(
+                TryOnRequest(image_url=inputs.image(recorded["image_url"]), **options),
+                client(key or recorded["image_url"]),
+            )
+            if key:
+                sessions[key].set_result(response.session_id)
+        else:
+            session_id = await session_for(recorded["session_id"], options)
+            if session_id is None:
+                results.append({"endpoint": trace["endpoint"], "status": "no_session", "seconds": 0.0})
+                return
+            _recorded.set(stub_latencies(trace))
+            start = time.perf_counter()
+            response = await main.chat(ChatRequest(
+                session_id=session_id,
+                message="make the hoodie cropped",
+                image_url=inputs.image(recorded.get("image_url") or recorded.get("image_data")),
+                **options,
+            ), client(recorded["session_id"]))
+
+        results.append({
+            "endpoint": trace["endpoint"],
+            "status": response.status,
+            "seconds": time.perf_counter() - start,
+            "wait_s": start - scheduled,
+            "recorded_s": trace["duration_s"],
+            "error": response.error if response.status == "error" else None,
+        })
+
+    # Sessions created by recorded try-ons; chat turns on any other session get a setup try-on
+    for trace in traces:
+        if trace["endpoint"] == "/try-on" and trace["outputs"].get("session_id"):
+            sessions[trace["outputs"]["session_id"]] = asyncio.get_running_loop().create_future()
+
+    t0 = traces[0]["started_at"]
+    delays = [
+        i / args.rate if args.rate else (t["started_at"] - t0) / args.speed
+        for i, t in enumerate(traces)
+    ]
+    started = time.perf_counter()
+    await asyncio.gather(*(run_one(t, d) for t, d in zip(traces, delays)))
+    wall = time.perf_counter() - started
+
+    endpoints = {}
+    for endpoint in sorted({r["endpoint"] for r in results}):
+        rows = [r for r in results if r["endpoint"] == endpoint]
+        done = [r["seconds"] for r in rows if r["status"] == "success"]
+        statuses = defaultdict(int)
+        for r in rows:
+            statuses[r["status"]] += 1
+        endpoints[endpoint] = {
+            "count": len(rows),
+            "statuses": dict(statuses),
+            "p50_s": percentile(done, 50),
+            "p95_s": percentile(done, 95),
+            "max_s": max(done, default=None),
+            "recorded_p95_s": percentile([r["recorded_s"] for r in rows if "recorded_s" in r], 95),
+            "throughput_rps": len(done) / wall,
+            "errors": sorted({r["error"] for r in rows if r.get("error")})[:5],
+        }
+    return {
+        "traces": len(traces),
+        "speed": args.speed,
+        "rate": args.rate,
+        "latency_scale": args.latency_scale,
+        "wall_s": wall,
+        "endpoints": endpoints,
+        "stages": metrics.snapshot(),
+        "memory": memory.budget.snapshot(),
+    }
+
+
+# --- Reports --------------------------------------------------------------
+
+
+def print_report(report: dict) -> None:
+    print(f"=== Replay: {report['traces']} traces in {report['wall_s']:.1f}s ===")
+    for endpoint, e in report["endpoints"].items():
+        p50 = f"{e['p50_s']:.2f}s" if e["p50_s"] is not None else "-"
+        p95 = f"{e['p95_s']:.2f}s" if e["p95_s"] is not None else "-"
+        print(f"  {endpoint:<8} n={e['count']:<4} p50={p50:<7} p95={p95:<7} "
+              f"{e['throughput_rps']:.2f} req/s  {e['statuses']}")
+    queues = {name: s for name, s in report["stages"].items() if name.startswith("queue.")}
+    for name, s in queues.items():
+        print(f"  {name:<28} n={s['calls']:<4} p95 wait={s['p95_s']:.2f}s")
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> bool:
+    """Print deltas against a baseline report. Returns True if anything regressed."""
+    regressed = False
+    print(f"=== Compared with baseline (threshold {threshold:.0%}) ===")
+    for endpoint, e in report["endpoints"].items():
+        b = baseline["endpoints"].get(endpoint)
+        if b is None or not e["p95_s"] or not b["p95_s"]:
+            continue
+        p95_delta = e["p95_s"] / b["p95_s"] - 1
+        rps_delta = e["throughput_rps"] / b["throughput_rps"] - 1 if b["throughput_rps"] else 0.0
+        bad = p95_delta > threshold or rps_delta < -threshold
+        regressed |= bad
+        print(f"  {endpoint:<8} p95 {b['p95_s']:.2f}s -> {e['p95_s']:.2f}s ({p95_delta:+.1%})  "
+              f"throughput {rps_delta:+.1%}  {'REGRESSION' if bad else 'ok'}")
+    return regressed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("traces", nargs="?", type=Path, default=GOLDEN_TRACES)
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay arrivals N times faster than recorded")
+    parser.add_argument("--rate", type=float, default=0.0, help="Fixed arrival rate (req/s) instead of recorded spacing")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiply stubbed provider latencies")
+    parser.add_argument("--out", type=Path, help="Write the JSON report here")
+    parser.add_argument("--compare", type=Path, help="Baseline report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed fractional regression")
+    parser.add_argument("--synthesize", action="store_true", help="(Re)write the synthetic trace file and exit")
+    args = parser.parse_args()
+
+    if args.synthesize:
+        synthesize(args.traces)
+        return 0
+
+    traces = load_traces(args.traces)
+    fallbacks = {
+        stage: statistics.median(s["seconds"] for t in traces for s in t["stages"] if s["stage"] == stage)
+        for stage in {s["stage"] for t in traces for s in t["stages"]}
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = Path(tmp)
+        (data_dir / "photos").mkdir()
+        (data_dir / "results").mkdir()
+        (data_dir / "photos" / "full_body_replay0.jpg").write_bytes(make_image((3024, 4032), "JPEG"))
+        # Configure the backend before it is imported: local dirs, no rembg model, no tracing
+        os.environ.update({
+            "PHOTOS_DIR": str(data_dir / "photos"),
+            "RESULTS_DIR": str(data_dir / "results"),
+            "SESSION_STORE": "memory",
+            "REMBG_SERVICE_URL": "http://replay.invalid",
+            "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY") or "replay",
+            "TRACE_PATH": "",
+        })
+        install_stubs(args.latency_scale, fallbacks)
+        report = asyncio.run(replay(traces, args, data_dir))
+
+    print_report(report)
+    if args.out:
+        args.out.write_text(json.dumps(report, indent=2))
+    if args.compare:
+        return 1 if compare(report, json.loads(args.compare.read_text()), args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
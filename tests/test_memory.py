@@ -0,0 +1,135 @@
+"""Leak guard: image buffers must be freed once a request is done with them.
+
+Checks that repeated imaging.prepare() calls leave no Pillow image blocks
+alive (Image.core.get_stats(); Pillow's pixel memory is invisible to
+tracemalloc), that a prepare() call's peak RSS stays well under a full
+decode of the frame (measured in a fresh subprocess), and that
+memory.request_buffers releases (and closes) everything it tracked and
+makes new requests wait while the budget is exhausted. No API keys needed.
+"""
+
+import asyncio
+import io
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from backend import imaging, memory
+
+SAMPLE_SIZE = (3000, 4000)
+
+# Pillow stores RGB as 4 bytes per pixel, so a full decode of the sample is ~48MB
+FULL_FRAME_BYTES = SAMPLE_SIZE[0] * SAMPLE_SIZE[1] * 4
+
+# Draft decoding reads the sample at 1/2 scale (~32MB peak with decoder buffers and the
+# resize); a full decode (~120MB peak) holds the whole frame, so it can't fit under this
+PEAK_RSS_LIMIT = FULL_FRAME_BYTES
+
+# Runs in a fresh process: freed pixel memory stays resident in this one, and
+# ru_maxrss is inherited across fork, so neither can show a new peak here.
+# Writing 5 to clear_refs resets VmHWM (peak RSS) to the current RSS.
+_PEAK_SCRIPT = r"""
+import re, sys
+from backend import imaging
+def hwm():
+    return int(re.search(r"VmHWM:\s+(\d+)", open("/proc/self/status").read()).group(1)) * 1024
+data = open(sys.argv[1], "rb").read()
+with open("/proc/self/clear_refs", "w") as f:
+    f.write("5")
+before = hwm()
+imaging.prepare(data).buf.close()
+print(hwm() - before)
+"""
+
+
+def sample_jpeg(width: int = SAMPLE_SIZE[0], height: int = SAMPLE_SIZE[1]) -> bytes:
+    with Image.radial_gradient("L") as gradient, gradient.resize((width, height)) as big, big.convert("RGB") as img:
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def _live_blocks() -> int:
+    stats = Image.core.get_stats()
+    return stats["allocated_blocks"] + stats["reused_blocks"] - stats["freed_blocks"]
+
+
+def test_prepare_does_not_leak():
+    data = sample_jpeg()
+    imaging.prepare(data).buf.close()  # warm up
+    before = _live_blocks()
+    for _ in range(20):
+        imaging.prepare(data).buf.close()
+    leaked = _live_blocks() - before
+    assert leaked == 0, f"imaging.prepare leaks image memory ({leaked} blocks)"
+
+
+def test_prepare_peak():
+    if not Path("/proc/self/clear_refs").exists():
+        pytest.skip("needs Linux /proc/self/clear_refs")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "sample.jpg"
+        path.write_bytes(sample_jpeg())
+        result = subprocess.run(
+            [sys.executable, "-c", _PEAK_SCRIPT, str(path)],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent.parent,
+        )
+    growth = int(result.stdout.strip())
+    assert growth < PEAK_RSS_LIMIT, f"imaging.prepare peak RSS grew {growth} bytes"
+
+
+async def _request_buffers(data: bytes) -> None:
+    budget = memory.MemoryBudget(limit_bytes=0)
+    async with memory.request_buffers("test", budget) as buffers:
+        raw = buffers.hold(data)
+        buf = buffers.hold(imaging.prepare(raw).buf)
+        assert budget.live_bytes == len(data) + buf.getbuffer().nbytes
+        buffers.release(raw)
+        assert budget.live_bytes == buf.getbuffer().nbytes
+
+        # Nested trackers share the outer request's accounting
+        async with memory.request_buffers("nested", budget) as nested:
+            assert nested is buffers
+        assert not buf.closed
+
+    assert budget.live_bytes == 0, "buffers still counted after the request ended"
+    assert buf.closed, "BytesIO not closed on request exit"
+    assert budget.requests == {}
+
+
+async def _budget_blocks(data: bytes) -> None:
+    budget = memory.MemoryBudget(limit_bytes=len(data))
+    first_done = asyncio.Event()
+    order: list[str] = []
+
+    async def first() -> None:
+        async with memory.request_buffers("first", budget) as buffers:
+            buffers.hold(data)
+            order.append("first")
+            await first_done.wait()
+
+    async def second() -> None:
+        async with memory.request_buffers("second", budget):
+            order.append("second")
+
+    task1 = asyncio.create_task(first())
+    await asyncio.sleep(0)
+    task2 = asyncio.create_task(second())
+    await asyncio.sleep(0.05)
+    assert order == ["first"] and budget.waiting == 1, "second request admitted over budget"
+
+    first_done.set()
+    await asyncio.wait_for(asyncio.gather(task1, task2), timeout=1)
+    assert order == ["first", "second"] and budget.live_bytes == 0
+
+
+def test_request_buffers():
+    asyncio.run(_request_buffers(sample_jpeg()))
+
+
+def test_budget_blocks():
+    asyncio.run(_budget_blocks(sample_jpeg()))
@@ -0,0 +1,31 @@
+"""Request validation: out-of-range result sizes are rejected with a 422."""
+
+from tests import _env  # noqa: F401  (must precede backend imports)
+
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+from backend.main import app
+from backend.models import RESULT_MAX_SIZE_LIMIT, ChatRequest, SessionMessage, TryOnRequest
+
+
+def test_result_max_size_bounds():
+    for bad in (-5, 0, RESULT_MAX_SIZE_LIMIT + 1):
+        for build in (
+            lambda: TryOnRequest(image_url="http://localhost/a.jpg", result_max_size=bad),
+            lambda: ChatRequest(session_id="s", message="m", result_max_size=bad),
+            lambda: SessionMessage(type="chat", result_max_size=bad),
+        ):
+            try:
+                build()
+            except ValidationError:
+                continue
+            raise AssertionError(f"result_max_size={bad} accepted")
+    assert TryOnRequest(image_url="http://localhost/a.jpg", result_max_size=512).result_max_size == 512
+    assert TryOnRequest(image_url="http://localhost/a.jpg").result_max_size is None
+
+
+def test_try_on_rejects_bad_size():
+    with TestClient(app) as client:
+        response = client.post("/try-on", json={"image_url": "http://localhost/a.jpg", "result_max_size": 0})
+        assert response.status_code == 422, response.text
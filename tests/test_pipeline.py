@@ -0,0 +1,44 @@
+import asyncio
+from datetime import timedelta
+
+from tests import _env  # noqa: F401  (must precede backend imports)
+
+from backend import pipeline
+
+RECORD = {
+    "user_photo_url": "http://localhost:8000/photos/full_body_test.jpg",
+    "original_image_url": "http://localhost:8000/photos/outfit_test.jpg",
+    "current_description": {"description": "black hoodie", "fit_notes": "relaxed", "colors": ["black"], "style": "street"},
+    "current_result_url": "http://localhost:8000/results/tryon_test.png",
+    "chat_history": [],
+    "created_at": "2026-01-01T00:00:00",
+}
+
+
+def test_idle_hot_sessions_pruned_when_another_worker_expired_them():
+    async def scenario() -> None:
+        for sid in ("kept", "gone-elsewhere"):
+            await pipeline._store.create(sid, dict(RECORD))
+            assert await pipeline.get_session(sid) is not None
+
+        # Another worker expires the session in the shared store; this one never hears about it
+        await pipeline._store.expire(-1)
+        await pipeline._store.create("kept", dict(RECORD))
+        pipeline._sessions["gone-elsewhere"].last_active -= timedelta(seconds=pipeline.SESSION_TTL_SECONDS + 1)
+
+        await pipeline._cleanup_expired()
+        assert "gone-elsewhere" not in pipeline._sessions
+        assert "kept" in pipeline._sessions
+
+    asyncio.run(scenario())
+
+
+def test_get_session_drops_deleted_session():
+    async def scenario() -> None:
+        await pipeline._store.create("deleted", dict(RECORD))
+        await pipeline.get_session("deleted")
+        await pipeline._store.expire(-1)
+        assert await pipeline.get_session("deleted") is None
+        assert "deleted" not in pipeline._sessions
+
+    asyncio.run(scenario())
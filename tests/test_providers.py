@@ -0,0 +1,89 @@
+"""Provider fallback: a failure anywhere in a provider's generation moves on to the next one.
+
+Replaces the Replicate call and post-processing with stubs; no API keys needed.
+"""
+
+import asyncio
+from dataclasses import replace
+
+from tests import _env  # noqa: F401  (must precede backend imports)
+
+from backend import providers
+from backend.photo_artifacts import PhotoArtifacts
+
+USER_PHOTO = PhotoArtifacts(
+    url="http://localhost/photos/full_body.jpg", content_hash="0" * 64,
+    width=768, height=1024, aspect_ratio="3:4", jpeg=b"",
+)
+
+
+async def _generate_with_broken_idm_vton_postprocess() -> str:
+    calls: list[str] = []
+
+    async def run_tryon(**kwargs) -> str:
+        calls.append("idm-vton")
+        return "https://replicate.delivery/idm-vton.png"
+
+    async def postprocess_result(raw_url: str, on_stage=None) -> str:
+        raise OSError("cannot identify image file")
+
+    async def flux(**kwargs) -> str:
+        calls.append("flux")
+        return "http://localhost/results/tryon_flux.png"
+
+    originals = providers.run_tryon, providers.postprocess_result, providers.route
+    providers.run_tryon = run_tryon
+    providers.postprocess_result = postprocess_result
+    providers.route = lambda mode: [providers.PROVIDERS["idm-vton"], replace(providers.PROVIDERS["flux"], generate=flux)]
+    try:
+        result = await providers.run_generation(USER_PHOTO, "black hoodie", "http://localhost/outfit.jpg")
+    finally:
+        providers.run_tryon, providers.postprocess_result, providers.route = originals
+    assert calls == ["idm-vton", "flux"], calls
+    return result
+
+
+def test_postprocess_failure_falls_back():
+    result = asyncio.run(_generate_with_broken_idm_vton_postprocess())
+    assert result == "http://localhost/results/tryon_flux.png"
+
+
+def test_postprocess_failure_is_runtime_error():
+    async def postprocess_result(raw_url: str, on_stage=None) -> str:
+        raise OSError("cannot identify image file")
+
+    async def run_tryon(**kwargs) -> str:
+        return "https://replicate.delivery/idm-vton.png"
+
+    originals = providers.run_tryon, providers.postprocess_result
+    providers.run_tryon, providers.postprocess_result = run_tryon, postprocess_result
+    try:
+        asyncio.run(providers._idm_vton(USER_PHOTO, "black hoodie", "http://localhost/outfit.jpg"))
+    except RuntimeError as e:
+        assert isinstance(e.__cause__, OSError)
+    else:
+        raise AssertionError("post-processing error was swallowed")
+    finally:
+        providers.run_tryon, providers.postprocess_result = originals
+
+
+def test_cheap_provider_keeps_unhealthy_as_fallback():
+    calls: list[str] = []
+
+    def provider(name: str, cost_usd: float, healthy: bool) -> providers.Provider:
+        async def generate(**kwargs) -> str:
+            calls.append(name)
+            return f"http://localhost/results/{name}.png"
+
+        stub = replace(providers.PROVIDERS[name], cost_usd=cost_usd, generate=generate)
+        stub.healthy = lambda: healthy
+        return stub
+
+    originals = providers.route, providers.degraded.use
+    providers.route = lambda mode: [provider("flux", 0.08, True), provider("idm-vton", 0.03, False)]
+    providers.degraded.use = lambda action: action == "cheap_provider"
+    try:
+        asyncio.run(providers.run_generation(USER_PHOTO, "black hoodie", "http://localhost/outfit.jpg"))
+    finally:
+        providers.route, providers.degraded.use = originals
+    assert calls == ["flux"], calls
@@ -0,0 +1,74 @@
+"""Scheduler ordering: priority classes, reserved slots, per-user caps and fairness.
+
+Drives a scheduler.Resource directly with sleeping jobs; no API keys needed.
+"""
+
+import asyncio
+
+from backend import scheduler
+
+
+async def _run_jobs(resource: scheduler.Resource, jobs: list[tuple[str, str, str]], hold: float = 0.02) -> list[str]:
+    """Queue (class, user, tag) jobs behind a full Resource; returns tags in grant order."""
+    order: list[str] = []
+
+    async def job(job_class: str, user: str, tag: str) -> None:
+        await resource.acquire(job_class, user)
+        order.append(tag)
+        await asyncio.sleep(hold)
+        resource.release(job_class, user)
+
+    blockers = [asyncio.create_task(job("interactive", f"blocker{i}", "blocker")) for i in range(resource.limit)]
+    await asyncio.sleep(0)
+    tasks = [asyncio.create_task(job(*j)) for j in jobs]
+    await asyncio.gather(*blockers, *tasks)
+    return [tag for tag in order if tag != "blocker"]
+
+
+def test_interactive_before_tryon_before_background():
+    order = asyncio.run(_run_jobs(scheduler.Resource("test", 4), [
+        ("background", "s", "bg"), ("tryon", "a", "tryon"), ("interactive", "b", "chat"),
+    ]))
+    assert order == ["chat", "tryon", "bg"]
+
+
+def test_batch_does_not_hold_every_slot():
+    async def scenario() -> None:
+        resource = scheduler.Resource("test", 4)
+        for _ in range(4):
+            asyncio.create_task(resource.acquire("tryon", "batch"))
+        await asyncio.sleep(0)
+        assert resource.active["tryon"] == scheduler.SCHEDULER_TRYON_PER_USER
+
+        # Other users' try-ons fill the rest, short of the slot kept for chat turns
+        await resource.acquire("tryon", "b")
+        await resource.acquire("tryon", "c")
+        blocked = asyncio.create_task(resource.acquire("tryon", "d"))
+        await asyncio.sleep(0)
+        assert not blocked.done()
+        await asyncio.wait_for(resource.acquire("interactive", "chat"), timeout=0.1)
+        blocked.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_users_take_turns_within_a_class():
+    order = asyncio.run(_run_jobs(scheduler.Resource("test", 2), [
+        ("tryon", "a", "a1"), ("tryon", "a", "a2"), ("tryon", "a", "a3"), ("tryon", "b", "b1"), ("tryon", "b", "b2"),
+    ]))
+    assert order.index("b1") < order.index("a2") and order.index("b2") < order.index("a3")
+
+
+def test_cancelled_waiter_frees_its_place():
+    async def scenario() -> None:
+        resource = scheduler.Resource("test", 1)
+        await resource.acquire("interactive", "a")
+        waiter = asyncio.create_task(resource.acquire("interactive", "b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        resource.release("interactive", "a")
+        assert sum(resource.active.values()) == 0
+        await asyncio.wait_for(resource.acquire("tryon", "c"), timeout=0.1)
+
+    asyncio.run(scenario())
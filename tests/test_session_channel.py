@@ -0,0 +1,64 @@
+"""WebSocket session channel: every chat turn ends with a terminal frame.
+
+A turn that fails with an unexpected exception (an httpx or Pillow error,
+not just ValueError/RuntimeError) must still send an error frame, or the
+client's spinner never stops. No API keys needed.
+"""
+
+import asyncio
+
+from tests import _env  # noqa: F401  (must precede backend imports)
+
+import httpx
+from PIL import UnidentifiedImageError
+
+from backend import main as api
+from backend.models import SessionMessage
+
+
+class FakeWebSocket:
+    """Collects the frames a turn sends."""
+
+    client = None
+
+    def __init__(self) -> None:
+        self.frames: list[dict] = []
+
+    async def send_json(self, data: dict) -> None:
+        self.frames.append(data)
+
+
+def test_unexpected_errors_send_error_frame():
+    original = api.chat_modify
+    try:
+        for error in (httpx.ConnectError("connection refused"), UnidentifiedImageError("cannot identify image file")):
+            async def chat_modify(**kwargs):
+                raise error
+
+            api.chat_modify = chat_modify
+            websocket = FakeWebSocket()
+            asyncio.run(api._session_turn(websocket, "ws-test", SessionMessage(type="chat", message="make it cropped")))
+            assert [f["type"] for f in websocket.frames] == ["error"], websocket.frames
+            assert str(error) in websocket.frames[0]["error"]
+    finally:
+        api.chat_modify = original
+
+
+class ClosedWebSocket(FakeWebSocket):
+    """A socket the client has already closed, as Starlette reports it."""
+
+    async def send_json(self, data: dict) -> None:
+        raise RuntimeError('Cannot call "send" once a close message has been sent.')
+
+
+def test_closed_socket_ends_turn_quietly():
+    original = api.chat_modify
+
+    async def chat_modify(**kwargs):
+        raise ValueError("Session ws-test not found or expired")
+
+    api.chat_modify = chat_modify
+    try:
+        asyncio.run(api._session_turn(ClosedWebSocket(), "ws-test", SessionMessage(type="chat", message="make it cropped")))
+    finally:
+        api.chat_modify = original
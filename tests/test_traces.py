@@ -0,0 +1,45 @@
+"""Traces: inputs are keyed-hashed, and lines are written off the event loop."""
+
+import asyncio
+import hashlib
+import json
+import threading
+
+from tests import _env  # noqa: F401  (must precede backend imports)
+
+from backend import traces
+from backend.models import ChatRequest
+
+
+def test_hash_is_keyed():
+    message = "make the hoodie cropped"
+    assert traces.hash_value(message) == traces.hash_value(message)
+    assert traces.hash_value(message) != hashlib.sha256(message.encode()).hexdigest()[:16]
+
+
+def test_traces_written_by_background_thread():
+    path = _env.DATA_DIR / "traces.jsonl"
+    writers: list[str] = []
+    original_write = traces._write_lines
+
+    def write_lines() -> None:
+        writers.append(threading.current_thread().name)
+        original_write()
+
+    traces.TRACE_PATH, traces._write_lines = str(path), write_lines
+    try:
+        async def turn() -> None:
+            request = ChatRequest(session_id="abc123", message="make the hoodie cropped")
+            async with traces.capture("/chat", request) as trace:
+                trace.status = "success"
+
+        for _ in range(3):
+            asyncio.run(turn())
+        traces._stop_writer()
+    finally:
+        traces.TRACE_PATH, traces._write_lines, traces._writer = "", original_write, None
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(records) == 3 and writers == ["trace-writer"]
+    assert records[0]["inputs"]["message"] == traces.hash_value("make the hoodie cropped")
+    assert "cropped" not in path.read_text()
@@ -0,0 +1,45 @@
+"""Photo uploads: an unreadable image is rejected without replacing the stored photo.
+
+Runs the FastAPI app in-process against scratch dirs (tests/_env.py); no API keys needed.
+"""
+
+import io
+
+from tests import _env  # noqa: F401  (must precede backend imports)
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from backend import photo_artifacts
+from backend.main import app
+
+
+def _jpeg() -> bytes:
+    buf = io.BytesIO()
+    with Image.new("RGB", (600, 800), "navy") as img:
+        img.save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+def _upload(client: TestClient, content: bytes, photo_type: str = "full_body"):
+    return client.post(
+        "/upload-photo", params={"photo_type": photo_type},
+        files={"file": ("photo.jpg", content, "image/jpeg")},
+    )
+
+
+def test_invalid_upload_keeps_previous_photo():
+    with TestClient(app) as client:
+        good = _upload(client, _jpeg())
+        assert good.status_code == 200, good.text
+        good_url = good.json()["photo_url"]
+
+        for bad in (b"not an image", _jpeg()[:200]):
+            response = _upload(client, bad)
+            assert response.status_code == 400, response.text
+            assert client.get("/user-photos").json()["full_body"] == good_url
+
+        face = _upload(client, b"not an image", "face")
+        assert face.status_code == 400, face.text
+
+    assert photo_artifacts._cache[good_url].aspect_ratio == "3:4"